@@ -0,0 +1,73 @@
+import os
+import signal
+import threading
+from dataclasses import dataclass
+
+PERSONA_ENV_PREFIX = "CHARACTER_CONTEXT_LINE_"
+PERSONA_FILE = os.getenv("PERSONA_FILE")
+
+class PersonaError(Exception):
+    pass
+
+@dataclass(frozen=True)
+class Persona:
+    text: str
+    source: str
+    estimated_tokens: int
+
+def estimate_tokens(text):
+    # Rough count (about 4 characters per token), enough to tell whether the
+    # persona clears the prompt caching minimum without an API call.
+    return len(text) // 4
+
+def load_persona(line_count, path=None):
+    if path:
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                text = file.read().strip()
+        except OSError as e:
+            raise PersonaError(f"Cannot read persona file {path}: {e}")
+        source = path
+    else:
+        names = [f"{PERSONA_ENV_PREFIX}{i}" for i in range(1, line_count + 1)]
+        missing = [name for name in names if name not in os.environ]
+        if missing:
+            raise PersonaError(f"Missing persona lines: {', '.join(missing)}")
+        text = "".join(os.environ[name] for name in names)
+        source = f"{PERSONA_ENV_PREFIX}1..{line_count}"
+    if not text:
+        raise PersonaError(f"Persona from {source} is empty")
+    return Persona(text=text, source=source, estimated_tokens=estimate_tokens(text))
+
+class PersonaStore:
+    def __init__(self, line_count, path=PERSONA_FILE):
+        self.line_count = line_count
+        self.path = path
+        self.lock = threading.Lock()
+        self.persona = load_persona(line_count, path)
+        print(f"Persona loaded from {self.persona.source} (about {self.persona.estimated_tokens} tokens).")
+
+    def get(self):
+        return self.persona
+
+    def reload(self):
+        with self.lock:
+            if not self.path:
+                try:
+                    from dotenv import load_dotenv
+                    load_dotenv(override=True)
+                except ImportError:
+                    pass
+            try:
+                persona = load_persona(self.line_count, self.path)
+            except PersonaError as e:
+                print(f"Persona reload failed, keeping the current persona: {e}")
+                return False
+            self.persona = persona
+            print(f"Persona reloaded from {persona.source} (about {persona.estimated_tokens} tokens).")
+            return True
+
+    def reload_on_sighup(self):
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+        return self
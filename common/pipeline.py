@@ -0,0 +1,165 @@
+import asyncio
+import os
+import queue
+import threading
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "10"))
+
+def stage_workers(env_name, default):
+    return int(os.getenv(env_name, str(default)))
+
+class ProviderLimit:
+    # Caps calls to one provider across every stage that uses it, however
+    # the stage worker counts add up. Use it as a context manager, or wrap a
+    # client so each messages.create() call takes a slot.
+    def __init__(self, env_name, default):
+        self.semaphore = threading.BoundedSemaphore(stage_workers(env_name, default))
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+    def wrap(self, client):
+        return LimitedClient(client, self)
+
+class LimitedMessages:
+    def __init__(self, messages, limit):
+        self._messages = messages
+        self._limit = limit
+
+    def create(self, *args, **kwargs):
+        with self._limit:
+            return self._messages.create(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._messages, name)
+
+class LimitedClient:
+    def __init__(self, client, limit):
+        self._client = client
+        self.messages = LimitedMessages(client.messages, limit)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+claude_limit = ProviderLimit("CLAUDE_MAX_CONCURRENCY", 4)
+
+class Stage:
+    def __init__(self, name, handler, workers=1):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+
+class Pipeline:
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, on_done=None, on_error=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.on_done = on_done
+        self.on_error = on_error
+        self.condition = threading.Condition()
+        self.pending_jobs = 0
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threading.Thread(target=self._work, args=(index,), name=f"{stage.name}-{n + 1}", daemon=True).start()
+        return self
+
+    def submit(self, job):
+        with self.condition:
+            self.pending_jobs += 1
+        self.queues[0].put(job)
+
+    def pending(self):
+        with self.condition:
+            return self.pending_jobs
+
+    def wait_for_capacity(self, max_pending):
+        with self.condition:
+            if self.pending_jobs >= max_pending:
+                print(f"{self.pending_jobs} jobs still in the pipeline. Waiting for a free slot...")
+            while self.pending_jobs >= max_pending:
+                self.condition.wait()
+
+    def join(self):
+        with self.condition:
+            while self.pending_jobs:
+                self.condition.wait()
+
+    def _finish(self, job):
+        if self.on_done:
+            try:
+                self.on_done(job)
+            except Exception as e:
+                print(f"Error finishing job: {e}")
+        with self.condition:
+            self.pending_jobs -= 1
+            self.condition.notify_all()
+
+    def _work(self, index):
+        stage = self.stages[index]
+        while True:
+            job = self.queues[index].get()
+            try:
+                result = stage.handler(job)
+            except Exception as e:
+                print(f"Error in {stage.name} stage: {e}")
+                if self.on_error:
+                    try:
+                        self.on_error(job, stage.name, e)
+                    except Exception as error:
+                        print(f"Error handling {stage.name} failure: {error}")
+                result = None
+            if result is None or index == len(self.stages) - 1:
+                self._finish(job)
+            else:
+                self.queues[index + 1].put(result)
+
+class AsyncPipeline:
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, on_done=None, on_error=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_done = on_done
+        self.on_error = on_error
+        self.queues = []
+        self.tasks = []
+
+    def start(self):
+        self.queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self.tasks.append(asyncio.create_task(self._work(index)))
+        return self
+
+    async def submit(self, job):
+        await self.queues[0].put(job)
+
+    async def _finish(self, job):
+        if self.on_done:
+            try:
+                await self.on_done(job)
+            except Exception as e:
+                print(f"Error finishing job: {e}")
+
+    async def _work(self, index):
+        stage = self.stages[index]
+        while True:
+            job = await self.queues[index].get()
+            try:
+                result = await stage.handler(job)
+            except Exception as e:
+                print(f"Error in {stage.name} stage: {e}")
+                if self.on_error:
+                    try:
+                        await self.on_error(job, stage.name, e)
+                    except Exception as error:
+                        print(f"Error handling {stage.name} failure: {error}")
+                result = None
+            if result is None or index == len(self.stages) - 1:
+                await self._finish(job)
+            else:
+                await self.queues[index + 1].put(result)
@@ -0,0 +1,38 @@
+import threading
+
+MIN_CACHEABLE_TOKENS = 1024
+
+def cached_system(persona):
+    return [{"type": "text", "text": persona.text, "cache_control": {"type": "ephemeral"}}]
+
+class PromptCacheStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.read_tokens = 0
+        self.written_tokens = 0
+        self.uncached_tokens = 0
+
+    def record(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        read = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        with self.lock:
+            if read:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.read_tokens += read
+            self.written_tokens += written
+            self.uncached_tokens += usage.input_tokens
+            hits, misses = self.hits, self.misses
+        print(f"Prompt cache {'hit' if read else 'miss'}: {read} tokens read, {written} written, {usage.input_tokens} uncached ({hits} hits / {misses} misses so far)")
+
+def warn_if_uncacheable(persona):
+    if persona.estimated_tokens < MIN_CACHEABLE_TOKENS:
+        print(f"Persona is about {persona.estimated_tokens} tokens, below the {MIN_CACHEABLE_TOKENS} token minimum for prompt caching; it will not be cached.")
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+class TransportStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def record(self, host, requests=0, connections=0):
+        with self.lock:
+            entry = self.hosts.setdefault(host, {"requests": 0, "connections": 0})
+            entry["requests"] += requests
+            entry["connections"] += connections
+
+    def snapshot(self):
+        with self.lock:
+            return {host: dict(entry) for host, entry in self.hosts.items()}
+
+def format_stats(hosts):
+    lines = []
+    for host, entry in sorted(hosts.items()):
+        reused = max(entry["requests"] - entry["connections"], 0)
+        lines.append(f"{host}: {entry['requests']} requests over {entry['connections']} connections ({reused} reused)")
+    return "; ".join(lines) if lines else "no requests yet"
+
+class TimeoutSession(requests.Session):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        # Libraries such as tweepy call session.request without a timeout.
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+class HttpTransport:
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), pool_hosts=HTTP_POOL_HOSTS, pool_size=HTTP_POOL_SIZE):
+        self.session = TimeoutSession(timeout)
+        self.adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self):
+        # urllib3 keeps request and connection counters on each host pool.
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            entry = hosts.setdefault(pool.host, {"requests": 0, "connections": 0})
+            entry["requests"] += pool.num_requests
+            entry["connections"] += pool.num_connections
+        return hosts
+
+    def log_stats(self):
+        print(f"HTTP connection reuse: {format_stats(self.stats())}")
+
+class BufferedResponse:
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"{self.status_code} error for {self.url}: {self.text}")
+
+class AsyncHttpTransport:
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), pool_size=HTTP_POOL_SIZE):
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        self.pool_size = pool_size
+        self.counters = TransportStats()
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request_start)
+            trace.on_connection_create_end.append(self._on_connection_create)
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit_per_host=self.pool_size),
+                trace_configs=[trace]
+            )
+        return self.session
+
+    async def _on_request_start(self, session, context, params):
+        context.host = params.url.host
+        self.counters.record(params.url.host, requests=1)
+
+    async def _on_connection_create(self, session, context, params):
+        self.counters.record(getattr(context, "host", "unknown"), connections=1)
+
+    async def request(self, method, url, **kwargs):
+        async with self._get_session().request(method, url, **kwargs) as response:
+            content = await response.read()
+            return BufferedResponse(response.status, response.headers, content, url)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def stats(self):
+        return self.counters.snapshot()
+
+    def log_stats(self):
+        print(f"HTTP connection reuse: {format_stats(self.stats())}")
+
+http = HttpTransport()
@@ -1,6 +1,5 @@
 import asyncio
 from anthropic import AsyncAnthropic
-import requests
 from datetime import datetime, timedelta
 import os
 from telegram import Update
@@ -9,6 +8,12 @@ import cloudinary
 import cloudinary.uploader
 import time
 from dotenv import load_dotenv
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.persona import PersonaStore
+from common.transport import AsyncHttpTransport
+from common.prompt_cache import cached_system, prompt_cache_stats, warn_if_uncacheable
+from common.pipeline import AsyncPipeline, Stage, stage_workers
 
 load_dotenv()
 
@@ -19,6 +24,9 @@ cloudinary.config(
 )
 
 anthropic = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+http = AsyncHttpTransport()
+persona_store = PersonaStore(48).reload_on_sighup()
+warn_if_uncacheable(persona_store.get())
 
 ALLOWED_GROUP_IDS = {
     -1002484970203,
@@ -31,70 +39,20 @@ ALLOWED_GROUP_IDS = {
 
 user_last_response_time = {}
 MAX_CONCURRENT_REQUESTS = 5
-semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
 async def generate_text_with_claude(prompt):
     try:
         print("Generating response using Claude API...")
-        character_context = (
-        os.environ["CHARACTER_CONTEXT_LINE_1"] +
-        os.environ["CHARACTER_CONTEXT_LINE_2"] +
-        os.environ["CHARACTER_CONTEXT_LINE_3"] +
-        os.environ["CHARACTER_CONTEXT_LINE_4"] +
-        os.environ["CHARACTER_CONTEXT_LINE_5"] +
-        os.environ["CHARACTER_CONTEXT_LINE_6"] +
-        os.environ["CHARACTER_CONTEXT_LINE_7"] +
-        os.environ["CHARACTER_CONTEXT_LINE_8"] +
-        os.environ["CHARACTER_CONTEXT_LINE_9"] +
-        os.environ["CHARACTER_CONTEXT_LINE_10"] +
-        os.environ["CHARACTER_CONTEXT_LINE_11"] +
-        os.environ["CHARACTER_CONTEXT_LINE_12"] +
-        os.environ["CHARACTER_CONTEXT_LINE_13"] +
-        os.environ["CHARACTER_CONTEXT_LINE_14"] +
-        os.environ["CHARACTER_CONTEXT_LINE_15"] +
-        os.environ["CHARACTER_CONTEXT_LINE_16"] +
-        os.environ["CHARACTER_CONTEXT_LINE_17"] +
-        os.environ["CHARACTER_CONTEXT_LINE_18"] +
-        os.environ["CHARACTER_CONTEXT_LINE_19"] +
-        os.environ["CHARACTER_CONTEXT_LINE_20"] +
-        os.environ["CHARACTER_CONTEXT_LINE_21"] +
-        os.environ["CHARACTER_CONTEXT_LINE_22"] +
-        os.environ["CHARACTER_CONTEXT_LINE_23"] +
-        os.environ["CHARACTER_CONTEXT_LINE_24"] +
-        os.environ["CHARACTER_CONTEXT_LINE_25"] +
-        os.environ["CHARACTER_CONTEXT_LINE_26"] +
-        os.environ["CHARACTER_CONTEXT_LINE_27"] +
-        os.environ["CHARACTER_CONTEXT_LINE_28"] +
-        os.environ["CHARACTER_CONTEXT_LINE_29"] +
-        os.environ["CHARACTER_CONTEXT_LINE_30"] +
-        os.environ["CHARACTER_CONTEXT_LINE_31"] +
-        os.environ["CHARACTER_CONTEXT_LINE_32"] +
-        os.environ["CHARACTER_CONTEXT_LINE_33"] +
-        os.environ["CHARACTER_CONTEXT_LINE_34"] +
-        os.environ["CHARACTER_CONTEXT_LINE_35"] +
-        os.environ["CHARACTER_CONTEXT_LINE_36"] +
-        os.environ["CHARACTER_CONTEXT_LINE_37"] +
-        os.environ["CHARACTER_CONTEXT_LINE_38"] +
-        os.environ["CHARACTER_CONTEXT_LINE_39"] +
-        os.environ["CHARACTER_CONTEXT_LINE_40"] +
-        os.environ["CHARACTER_CONTEXT_LINE_41"] +
-        os.environ["CHARACTER_CONTEXT_LINE_42"] +
-        os.environ["CHARACTER_CONTEXT_LINE_43"] +
-        os.environ["CHARACTER_CONTEXT_LINE_44"] +
-        os.environ["CHARACTER_CONTEXT_LINE_45"] +
-        os.environ["CHARACTER_CONTEXT_LINE_46"] +
-        os.environ["CHARACTER_CONTEXT_LINE_47"] +
-        os.environ["CHARACTER_CONTEXT_LINE_48"]
-    )
         response = await anthropic.messages.create(
             model="claude-3-5-sonnet-20241022",
             max_tokens=80,
             temperature=0.8,
-            system=character_context,
+            system=cached_system(persona_store.get()),
             messages=[
                 {"role": "user", "content": prompt}
             ]
         )
+        prompt_cache_stats.record(response)
         generated_text = response.content[0].text
         print("Response generated:", generated_text)
         return generated_text.strip()
@@ -105,26 +63,23 @@ async def generate_text_with_claude(prompt):
 async def generate_audio_with_eleven_labs(text, voice_id, api_key):
     loop = asyncio.get_event_loop()
     try:
-        def make_request():
-            url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-            headers = {
-                "Accept": "audio/mpeg",
-                "Content-Type": "application/json",
-                "xi-api-key": api_key
-            }
-            data = {
-                "text": text,
-                "model_id": "eleven_multilingual_v2",
-                "voice_settings": {
-                    "style": 1,
-                    "use_speaker_boost": False,
-                    "similarity_boost": 0,
-                    "stability": 0
-                }
+        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+        headers = {
+            "Accept": "audio/mpeg",
+            "Content-Type": "application/json",
+            "xi-api-key": api_key
+        }
+        data = {
+            "text": text,
+            "model_id": "eleven_multilingual_v2",
+            "voice_settings": {
+                "style": 1,
+                "use_speaker_boost": False,
+                "similarity_boost": 0,
+                "stability": 0
             }
-            return requests.post(url, json=data, headers=headers)
-
-        response = await loop.run_in_executor(None, make_request)
+        }
+        response = await http.post(url, json=data, headers=headers)
         if response.status_code == 200:
             audio_file_path = f"audio_output_{int(time.time())}.mp3"
             with open(audio_file_path, "wb") as audio_file:
@@ -150,19 +105,15 @@ class AIAvatarCreator:
         }
 
     async def create_avatar(self, photo_url, audio_url, box_coordinates):
-        loop = asyncio.get_event_loop()
         try:
-            def make_request():
-                url = os.getenv("MOVEMENT_CREATE_URL")
-                data = {
-                    "photoUrl": photo_url,
-                    "info": [{"audioUrl": audio_url, "box": box_coordinates}],
-                    "watermark": 0,
-                    "useSr": False
-                }
-                return requests.post(url, json=data, headers=self.headers)
-
-            response = await loop.run_in_executor(None, make_request)
+            url = os.getenv("MOVEMENT_CREATE_URL")
+            data = {
+                "photoUrl": photo_url,
+                "info": [{"audioUrl": audio_url, "box": box_coordinates}],
+                "watermark": 0,
+                "useSr": False
+            }
+            response = await http.post(url, json=data, headers=self.headers)
             if response.status_code == 200:
                 result = response.json()
                 return result["data"]["id"]
@@ -173,14 +124,10 @@ class AIAvatarCreator:
             raise
 
     async def get_video_url(self, project_id, wait_time=5, max_retries=100):
-        loop = asyncio.get_event_loop()
         url = f"{os.getenv('MOVEMENT_PROJECT_URL')}/{project_id}"
         for i in range(max_retries):
             try:
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: requests.get(url, headers=self.headers)
-                )
+                response = await http.get(url, headers=self.headers)
                 if response.status_code == 200:
                     result = response.json()
                     if video_url := result["data"]["videoUrl"]:
@@ -190,48 +137,73 @@ class AIAvatarCreator:
             await asyncio.sleep(wait_time)
         raise Exception("Video generation timed out")
 
+# Each request moves through these stages as a job dict, so one user's reply
+# can be in TTS while another is still waiting on the avatar render.
+async def llm_stage(job):
+    job['response_text'] = await generate_text_with_claude(
+        job['message_text'].replace('/video/', '').replace('/audio/', '').strip()
+    )
+    return job
+
+async def tts_stage(job):
+    job['audio_url'] = await generate_audio_with_eleven_labs(
+        job['response_text'],
+        os.getenv("ELEVEN_LABS_VOICE_ID"),
+        os.getenv("ELEVEN_LABS_API_KEY")
+    )
+    return job
+
+async def avatar_stage(job):
+    if "/video/" not in job['message_text']:
+        return job
+    avatar_creator = AIAvatarCreator(os.getenv("MOVEMENT_API_KEY"))
+    project_id = await avatar_creator.create_avatar(
+        "https://s11.gifyu.com/images/SyFer.png",
+        job['audio_url'],
+        [444, 131, 733, 478]
+    )
+    if project_id:
+        job['video_url'] = await avatar_creator.get_video_url(project_id)
+    return job
+
+async def deliver_stage(job):
+    update = job['update']
+    message_id = update.message.message_id
+    if "/video/" in job['message_text']:
+        if job.get('video_url'):
+            video_path = f"response_video_{message_id}.mp4"
+            response = await http.get(job['video_url'])
+            with open(video_path, 'wb') as f:
+                f.write(response.content)
+            await update.message.reply_video(open(video_path, 'rb'))
+            os.remove(video_path)
+        else:
+            await update.message.reply_text("Failed to generate video.")
+    else:
+        audio_path = f"response_audio_{message_id}.mp3"
+        response = await http.get(job['audio_url'])
+        with open(audio_path, 'wb') as f:
+            f.write(response.content)
+        await update.message.reply_audio(
+            open(audio_path, 'rb'),
+            filename="Lea_response.mp3"
+        )
+        os.remove(audio_path)
+    http.log_stats()
+    return job
+
+async def report_error(job, stage_name, error):
+    await job['update'].message.reply_text("An error occurred while processing your request.")
+
+message_pipeline = AsyncPipeline([
+    Stage("claude", llm_stage, stage_workers("CLAUDE_MAX_CONCURRENCY", MAX_CONCURRENT_REQUESTS)),
+    Stage("elevenlabs", tts_stage, stage_workers("ELEVEN_LABS_MAX_CONCURRENCY", 2)),
+    Stage("movement", avatar_stage, stage_workers("MOVEMENT_MAX_CONCURRENCY", 2)),
+    Stage("deliver", deliver_stage, stage_workers("DELIVER_MAX_CONCURRENCY", 2))
+], on_error=report_error)
+
 async def process_message(update: Update, message_text: str):
-    async with semaphore:
-        try:
-            response_text = await generate_text_with_claude(
-                message_text.replace('/video/', '').replace('/audio/', '').strip()
-            )
-            audio_url = await generate_audio_with_eleven_labs(
-                response_text,
-                os.getenv("ELEVEN_LABS_VOICE_ID"),
-                os.getenv("ELEVEN_LABS_API_KEY")
-            )
-            if "/video/" in message_text:
-                avatar_creator = AIAvatarCreator(os.getenv("MOVEMENT_API_KEY"))
-                project_id = await avatar_creator.create_avatar(
-                    "https://s11.gifyu.com/images/SyFer.png",
-                    audio_url,
-                    [444, 131, 733, 478]
-                )
-                if project_id:
-                    video_url = await avatar_creator.get_video_url(project_id)
-                    if video_url:
-                        video_path = f"response_video_{int(time.time())}.mp4"
-                        response = requests.get(video_url)
-                        with open(video_path, 'wb') as f:
-                            f.write(response.content)
-                        await update.message.reply_video(open(video_path, 'rb'))
-                        os.remove(video_path)
-                    else:
-                        await update.message.reply_text("Failed to generate video.")
-            else:
-                audio_path = f"response_audio_{int(time.time())}.mp3"
-                response = requests.get(audio_url)
-                with open(audio_path, 'wb') as f:
-                    f.write(response.content)
-                await update.message.reply_audio(
-                    open(audio_path, 'rb'),
-                    filename="Lea_response.mp3"
-                )
-                os.remove(audio_path)
-        except Exception as e:
-            print(f"Error processing message: {e}")
-            await update.message.reply_text("An error occurred while processing your request.")
+    await message_pipeline.submit({'update': update, 'message_text': message_text})
 
 async def handle_message(update: Update, context: CallbackContext):
     if update.message.chat.id not in ALLOWED_GROUP_IDS:
@@ -254,8 +226,14 @@ async def handle_message(update: Update, context: CallbackContext):
 async def start(update: Update, context: CallbackContext):
     await update.message.reply_text('Hello! I am Lea. Mention me and choose /video/ or /audio/.')
 
+async def start_pipeline(application):
+    message_pipeline.start()
+
+async def close_http(application):
+    await http.close()
+
 def main():
-    application = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN")).build()
+    application = Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN")).post_init(start_pipeline).post_shutdown(close_http).build()
     application.add_handler(CommandHandler('start', start))
     application.add_handler(MessageHandler(
         filters.TEXT & filters.Regex('@Leagpt_bot'),
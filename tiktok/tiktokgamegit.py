@@ -1,4 +1,3 @@
-import requests
 import anthropic
 import time
 import os
@@ -9,6 +8,9 @@ from anthropic import Anthropic
 from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, CompositeVideoClip, ImageSequenceClip
 from PIL import Image
 import numpy as np
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import http
 
 SUBTITLES_API_KEY = os.environ["SUBTITLES_API_KEY"]
 SUBTITLES_TEMPLATE_ID = os.environ["SUBTITLES_TEMPLATE_ID"]
@@ -63,7 +65,7 @@ def generate_audio_with_eleven_labs(text, voice_id, api_key):
             "stability": 0
         }
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = http.post(url, json=data, headers=headers)
     if response.status_code == 200:
         try:
             audio_file_path = "audio_output.mp3"
@@ -97,7 +99,7 @@ class AIAvatarCreator:
             "useSr": False,
             "subtitles": 0
         }
-        response = requests.post(url, json=data, headers=self.headers)
+        response = http.post(url, json=data, headers=self.headers)
         if response.status_code == 200:
             result = response.json()
             project_id = result["data"]["id"]
@@ -111,7 +113,7 @@ class AIAvatarCreator:
         print("Waiting for avatar video to be ready...")
         url = f"{os.getenv('MOVEMENT_PROJECT_URL')}/{project_id}"
         for i in range(max_retries):
-            response = requests.get(url, headers=self.headers)
+            response = http.get(url, headers=self.headers)
             if response.status_code == 200:
                 result = response.json()
                 video_url = result["data"]["videoUrl"]
@@ -208,7 +210,7 @@ Rules:
         "max_tokens": 4096
     }
     try:
-        response = requests.post(
+        response = http.post(
             "https://api.anthropic.com/v1/messages",
             headers=headers,
             json=payload
@@ -237,7 +239,7 @@ def upload_video(file_path, api_key):
     headers = {"X-Api-Key": api_key}
     with open(file_path, 'rb') as file:
         files = {'file': file}
-        response = requests.post(url, headers=headers, files=files)
+        response = http.post(url, headers=headers, files=files)
     if response.status_code != 201:
         print("Upload error:", response.text)
         return None
@@ -249,7 +251,7 @@ def create_transcription_task(video_id, template_id, language='en'):
     url = f"https://api.subtitles.ai/videos/{video_id}/task"
     headers = {"Content-Type": "application/json", "X-Api-Key": SUBTITLES_API_KEY}
     payload = {"templateId": template_id, "language": language, "autoApprove": True}
-    response = requests.post(url, json=payload, headers=headers)
+    response = http.post(url, json=payload, headers=headers)
     if response.status_code != 201:
         print("Task creation error:", response.text)
         return None
@@ -263,7 +265,7 @@ def check_task_status(video_id, task_id):
     retry_count = 0
     max_retries = 30
     while retry_count < max_retries:
-        response = requests.get(url, headers=headers)
+        response = http.get(url, headers=headers)
         if response.status_code != 200:
             print("Status check error:", response.text)
             return None, None
@@ -281,7 +283,7 @@ def check_task_status(video_id, task_id):
 def get_transcript(video_id, task_id):
     url = f"https://api.subtitles.ai/videos/{video_id}/task/{task_id}/transcript"
     headers = {"X-Api-Key": SUBTITLES_API_KEY}
-    response = requests.get(url, headers=headers)
+    response = http.get(url, headers=headers)
     if response.status_code != 200:
         print("Transcript retrieval error:", response.text)
         return None
@@ -301,7 +303,7 @@ def create_subtitle_task(video_id, transcript):
             }
         }
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = http.post(url, headers=headers, json=payload)
     if response.status_code != 201:
         print("Subtitle task creation error:", response.text)
         return None
@@ -376,7 +378,7 @@ def process_responses():
                     video_url = avatar_creator.get_video_url(project_id)
                     if video_url:
                         local_video_path = "video_response.mp4"
-                        with requests.get(video_url, stream=True) as r:
+                        with http.get(video_url, stream=True) as r:
                             r.raise_for_status()
                             with open(local_video_path, 'wb') as f:
                                 for chunk in r.iter_content(chunk_size=8192):
@@ -405,7 +407,7 @@ def process_responses():
                             if not status or not final_video_url:
                                 raise Exception("Final video retrieval failed")
                             subtitled_video_path = "video_response_subtitled.mp4"
-                            with requests.get(final_video_url, stream=True) as r:
+                            with http.get(final_video_url, stream=True) as r:
                                 r.raise_for_status()
                                 with open(subtitled_video_path, 'wb') as f:
                                     for chunk in r.iter_content(chunk_size=8192):
@@ -470,3 +472,4 @@ def process_responses():
 
 if __name__ == "__main__":
     process_responses()
+    http.log_stats()
@@ -0,0 +1,100 @@
+import heapq
+import math
+import os
+import threading
+from datetime import datetime, timezone
+
+CANDIDATE_MAX_AGE_MINUTES = float(os.getenv("CANDIDATE_MAX_AGE_MINUTES", "30"))
+CANDIDATE_HALF_LIFE_MINUTES = float(os.getenv("CANDIDATE_HALF_LIFE_MINUTES", "10"))
+
+def tweet_age_minutes(tweet, now=None):
+    now = now or datetime.now(timezone.utc)
+    return max((now - tweet.created_at).total_seconds() / 60, 0)
+
+def score_candidate(candidate, now=None, half_life=CANDIDATE_HALF_LIFE_MINUTES):
+    tweet = candidate['tweet']
+    age = tweet_age_minutes(tweet, now)
+    metrics = tweet.public_metrics or {}
+    engagement = (
+        metrics.get('like_count', 0)
+        + 2 * metrics.get('retweet_count', 0)
+        + 2 * metrics.get('quote_count', 0)
+        + metrics.get('reply_count', 0)
+    )
+    velocity = engagement / max(age, 1)
+    reach = math.log10(1 + candidate.get('followers', 0))
+    freshness = 0.5 ** (age / half_life)
+    return (1 + velocity) * (1 + reach) * freshness
+
+class CandidateScheduler:
+    def __init__(self, max_age_minutes=CANDIDATE_MAX_AGE_MINUTES):
+        self.max_age_minutes = max_age_minutes
+        self.lock = threading.Lock()
+        self.candidates = {}
+        # Entries are (-score, sequence, tweet_id, candidate). Scores only go
+        # down as a tweet ages, so a stored score is an upper bound and stale
+        # entries are rescored when they reach the top, not on every pop.
+        self.heap = []
+        self.sequence = 0
+
+    def _push(self, candidate, now):
+        self.sequence += 1
+        tweet_id = str(candidate['tweet'].id)
+        heapq.heappush(self.heap, (-score_candidate(candidate, now), self.sequence, tweet_id, candidate))
+
+    def add(self, candidates):
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            for candidate in candidates:
+                self.candidates[str(candidate['tweet'].id)] = candidate
+                self._push(candidate, now)
+            # Replaced and discarded candidates leave dead entries behind.
+            if len(self.heap) > 2 * len(self.candidates) + 16:
+                self._rebuild(now)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.candidates)
+
+    def _expired(self, tweet_id, candidate, now):
+        if tweet_age_minutes(candidate['tweet'], now) <= self.max_age_minutes:
+            return False
+        print(f"Candidate {tweet_id} from @{candidate['username']} expired.")
+        del self.candidates[tweet_id]
+        return True
+
+    def _rebuild(self, now):
+        self.heap = []
+        for tweet_id, candidate in list(self.candidates.items()):
+            if not self._expired(tweet_id, candidate, now):
+                self.sequence += 1
+                self.heap.append((-score_candidate(candidate, now), self.sequence, tweet_id, candidate))
+        heapq.heapify(self.heap)
+
+    def pop(self, is_eligible=lambda candidate: True):
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            skipped = []
+            chosen = None
+            while self.heap:
+                negative_score, _, tweet_id, candidate = heapq.heappop(self.heap)
+                if self.candidates.get(tweet_id) is not candidate or self._expired(tweet_id, candidate, now):
+                    continue
+                score = score_candidate(candidate, now)
+                if score < -negative_score:
+                    self._push(candidate, now)
+                    continue
+                if not is_eligible(candidate):
+                    skipped.append(candidate)
+                    continue
+                del self.candidates[tweet_id]
+                print(f"Picked tweet {tweet_id} from @{candidate['username']} (score {score:.2f}).")
+                chosen = candidate
+                break
+            for candidate in skipped:
+                self._push(candidate, now)
+            return chosen
+
+    def discard(self, tweet_id):
+        with self.lock:
+            self.candidates.pop(str(tweet_id), None)
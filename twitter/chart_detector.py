@@ -0,0 +1,130 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+
+# "off" skips the detector, "hint" passes its reading to a shorter vision
+# prompt, "direct" uses a confident bullish/bearish reading as the analysis
+# with no call. Off by default until the detector has seen more real images.
+CHART_DETECTION = os.getenv("CHART_DETECTION", "off")
+CHART_DIRECT_CONFIDENCE = float(os.getenv("CHART_DIRECT_CONFIDENCE", "0.8"))
+CHART_BIG_CANDLE_RATIO = float(os.getenv("CHART_BIG_CANDLE_RATIO", "2.0"))
+# Bump when the detection logic changes, so cached chart readings are
+# not served from an older detector.
+CHART_DETECTOR_VERSION = "2"
+CHART_MIN_CANDLES = 12
+CHART_MAX_EDGE = 1600
+CHART_LOOKBACK = 20
+CHART_MIN_LEVELS = 0.3
+
+class ChartReading:
+    def __init__(self, trend, confidence, last_color, size_ratio, candles):
+        self.trend = trend
+        self.confidence = confidence
+        self.last_color = last_color
+        self.size_ratio = size_ratio
+        self.candles = candles
+
+    def is_direct(self, threshold=CHART_DIRECT_CONFIDENCE):
+        return self.trend != "neutral" and self.confidence > threshold
+
+    def describe(self):
+        return (
+            f"Candlestick chart with {self.candles} visible candles. The last candle is {self.last_color} "
+            f"and {self.size_ratio:.1f}x the size of the recent candles, so the chart looks {self.trend} "
+            f"(confidence {self.confidence:.0%})."
+        )
+
+def color_masks(pixels):
+    r, g, b = (pixels[..., i].astype(np.int16) for i in range(3))
+    green = (g > 90) & (g - r > 40) & (g - b > 10)
+    red = (r > 110) & (r - g > 50) & (r - b > 30)
+    # Rows colored across most of the width are price lines or bands, not
+    # candles, and would glue every column into one run.
+    for mask in (green, red):
+        mask[mask.mean(axis=1) > 0.3] = False
+    return green, red
+
+def column_runs(green, red):
+    greens = green.sum(axis=0)
+    reds = red.sum(axis=0)
+    colors = np.where((greens > 0) & (greens > 2 * reds), 1, np.where((reds > 0) & (reds > 2 * greens), -1, 0))
+    runs = []
+    start = None
+    for x in range(len(colors) + 1):
+        color = colors[x] if x < len(colors) else 0
+        if start is not None and color != colors[start]:
+            runs.append((int(colors[start]), start, x))
+            start = None
+        if start is None and color != 0:
+            start = x
+    return runs
+
+def top_segment(rows, max_gap=2):
+    # Volume bars share columns with their candle but sit below it, so only
+    # the topmost stack of colored rows belongs to the candle.
+    ys = np.flatnonzero(rows)
+    if not len(ys):
+        return None
+    end = 0
+    while end + 1 < len(ys) and ys[end + 1] - ys[end] <= max_gap + 1:
+        end += 1
+    return ys[0], ys[end]
+
+def candle_extent(mask, start, stop):
+    # (top, bottom, body height) of the candle in columns start:stop.
+    block = mask[:, start:stop]
+    segment = top_segment(block.any(axis=1))
+    if not segment:
+        return 0, 0, 0
+    top, bottom = segment
+    body = np.flatnonzero(block[top:bottom + 1].sum(axis=1) >= max(1, 0.6 * (stop - start)))
+    return int(top), int(bottom), int(body[-1] - body[0] + 1) if len(body) else 1
+
+def read_chart(image_content):
+    # Returns a ChartReading for candlestick charts, None for anything else.
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        image.thumbnail((CHART_MAX_EDGE, CHART_MAX_EDGE))
+        pixels = np.asarray(image.convert("RGB"))
+    except Exception as e:
+        print(f"Error decoding the image for chart detection: {e}")
+        return None
+    green, red = color_masks(pixels)
+    colored = (green | red).mean()
+    if colored < 0.002 or colored > 0.35:
+        return None
+    runs = column_runs(green, red)
+    if len(runs) < CHART_MIN_CANDLES:
+        return None
+    median_width = np.median([stop - start for _, start, stop in runs])
+    if median_width > pixels.shape[1] / 30:
+        return None
+    candles = [run for run in runs if run[2] - run[1] <= 3 * median_width + 1]
+    if len(candles) < CHART_MIN_CANDLES:
+        return None
+    greens = sum(1 for color, _, _ in candles if color == 1)
+    if min(greens, len(candles) - greens) < 0.2 * len(candles):
+        return None
+    centers = np.array([(start + stop) / 2 for _, start, stop in candles])
+    gaps = np.diff(centers)
+    regular = float(np.mean((gaps > 0.5 * np.median(gaps)) & (gaps < 1.5 * np.median(gaps))))
+    if regular < 0.5:
+        return None
+    extents = [candle_extent(green if color == 1 else red, start, stop) for color, start, stop in candles]
+    # Candles move up and down the price axis. Stripes share their top and
+    # bottom rows, bar charts share a baseline.
+    for edge in (0, 1):
+        if len({extent[edge] for extent in extents}) < CHART_MIN_LEVELS * len(extents):
+            return None
+    bodies = [extent[2] for extent in extents]
+    recent = np.median(bodies[-CHART_LOOKBACK - 1:-1])
+    size_ratio = bodies[-1] / max(recent, 1)
+    last_color = "green" if candles[-1][0] == 1 else "red"
+    if size_ratio >= CHART_BIG_CANDLE_RATIO:
+        trend = "bullish" if last_color == "green" else "bearish"
+        certainty = min(1.0, 0.6 + 0.4 * (size_ratio - CHART_BIG_CANDLE_RATIO) / CHART_BIG_CANDLE_RATIO)
+    else:
+        trend = "neutral"
+        certainty = min(1.0, 0.6 + 0.4 * (CHART_BIG_CANDLE_RATIO - size_ratio) / CHART_BIG_CANDLE_RATIO)
+    return ChartReading(trend, round(regular * certainty, 2), last_color, float(size_ratio), len(candles))
@@ -0,0 +1,64 @@
+import heapq
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+COOLDOWN_MIN_INTERVAL = int(os.getenv("COOLDOWN_MIN_INTERVAL", "900"))
+COOLDOWN_DAILY_LIMIT = int(os.getenv("COOLDOWN_DAILY_LIMIT", "2"))
+COOLDOWN_WINDOW = 24 * 60 * 60
+
+class CooldownTracker:
+    def __init__(self, min_interval=COOLDOWN_MIN_INTERVAL, daily_limit=COOLDOWN_DAILY_LIMIT, window=COOLDOWN_WINDOW):
+        self.min_interval = min_interval
+        self.daily_limit = daily_limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.heap = []
+
+    @classmethod
+    def from_ledger(cls, ledger, **kwargs):
+        tracker = cls(**kwargs)
+        since = datetime.now(timezone.utc) - timedelta(seconds=tracker.window)
+        for username, responded_at in ledger.responses_since(since):
+            tracker.record(username, responded_at.timestamp())
+        return tracker
+
+    def _next_eligible(self, username, now):
+        times = self.responses.get(username)
+        if not times:
+            return now
+        while times and times[0] <= now - self.window:
+            times.popleft()
+        if not times:
+            del self.responses[username]
+            return now
+        eligible = times[-1] + self.min_interval
+        if len(times) >= self.daily_limit:
+            eligible = max(eligible, times[-self.daily_limit] + self.window)
+        return eligible
+
+    def record(self, username, when=None):
+        when = time.time() if when is None else when
+        with self.lock:
+            self.responses.setdefault(username, deque()).append(when)
+            heapq.heappush(self.heap, (self._next_eligible(username, when), username))
+
+    def is_eligible(self, username, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            return self._next_eligible(username, now) <= now
+
+    def earliest_eligible(self, now=None):
+        # Entries go stale when a user responds again or their window
+        # slides; they are dropped lazily as they reach the top.
+        now = time.time() if now is None else now
+        with self.lock:
+            while self.heap:
+                eligible, username = self.heap[0]
+                if eligible > now and eligible == self._next_eligible(username, now):
+                    return eligible
+                heapq.heappop(self.heap)
+            return None
@@ -0,0 +1,277 @@
+import anthropic
+import tweepy
+import base64
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from image_cache import ImageAnalysisCache, content_hash, prompt_version
+from image_preprocess import media_variant_url, prepare_image
+from chart_detector import CHART_BIG_CANDLE_RATIO, CHART_DETECTION, CHART_DETECTOR_VERSION, CHART_DIRECT_CONFIDENCE, read_chart
+from common.pipeline import claude_limit
+from common.transport import http
+
+DEFAULT_IMAGE_PROMPT = "Describe precisely what you see in this image. Be detailed and objective. And give your opinion. If there are numbers associated to some token or nft, regroup them together and describe everything. If it's a chart, check if there is a big red candle at the end, means it's a rug or scam but if there is a big green candle, it's pumping so it's bullish so always say if it's a bullish chart, bearish or neutral. If it's not a chart, don't talk about chart. Always describe everything with precision"
+
+# "parallel" sends one vision call per image at the same time, "combined"
+# sends every image of a tweet in a single message.
+IMAGE_ANALYSIS_MODE = os.getenv("IMAGE_ANALYSIS_MODE", "parallel")
+IMAGE_MAX_WORKERS = int(os.getenv("IMAGE_MAX_WORKERS", "4"))
+IMAGE_INCLUDES_MAX = int(os.getenv("IMAGE_INCLUDES_MAX", "5000"))
+UNABLE_TO_ANALYZE = "Unable to analyze this image"
+NOT_A_CHART = "NOT A CHART"
+CHART_HINT_PROMPT = "A local detector suggests this image may be a candlestick price chart and read it as: {reading} If the image is not a price chart, reply only with \"" + NOT_A_CHART + "\". Otherwise check that reading against the chart and correct it if it is wrong. Then briefly give the token, timeframe and key numbers you can see, and say clearly whether the chart is bullish, bearish or neutral."
+IMAGE_SECTION_PATTERN = re.compile(r"^[\s#*]*Image (\d+)\s*:[\s*]*$", re.MULTILINE)
+
+class TwitterImageAnalyzer:
+    def __init__(self, bearer_token, claude_api_key, image_prompt=DEFAULT_IMAGE_PROMPT, mode=IMAGE_ANALYSIS_MODE, cache=None):
+        self.twitter_client = tweepy.Client(bearer_token=bearer_token)
+        self.claude_client = claude_limit.wrap(anthropic.Anthropic(api_key=claude_api_key))
+        self.image_prompt = image_prompt
+        self.prompt_version = prompt_version(image_prompt)
+        detector = f"{CHART_DETECTOR_VERSION}:{CHART_BIG_CANDLE_RATIO}"
+        self.hint_version = prompt_version(f"chart-hint:{detector}:{CHART_HINT_PROMPT}")
+        self.direct_version = prompt_version(f"chart-direct:{detector}:{CHART_DIRECT_CONFIDENCE}")
+        self.mode = mode
+        self.cache = cache or ImageAnalysisCache()
+        self.executor = ThreadPoolExecutor(max_workers=IMAGE_MAX_WORKERS, thread_name_prefix="image")
+        self.media = OrderedDict()
+        self.tweets = OrderedDict()
+        self.includes_lock = threading.Lock()
+
+    def remember_includes(self, includes):
+        # Media and referenced tweets expanded by the search and timeline
+        # calls, so images of a tweet, its parent and its quote are found
+        # without fetching any of them again.
+        if not includes:
+            return
+        with self.includes_lock:
+            for media in includes.get('media') or []:
+                self.media[media['media_key']] = media
+                self.media.move_to_end(media['media_key'])
+            for tweet in includes.get('tweets') or []:
+                self.tweets[str(tweet['id'])] = tweet
+                self.tweets.move_to_end(str(tweet['id']))
+            for index in (self.media, self.tweets):
+                while len(index) > IMAGE_INCLUDES_MAX:
+                    index.popitem(last=False)
+
+    def check_tweet_media(self, tweet_id):
+        try:
+            tweet = self.twitter_client.get_tweet(
+                id=tweet_id,
+                expansions=['attachments.media_keys'],
+                media_fields=['url', 'type']
+            )
+            if tweet.includes and 'media' in tweet.includes:
+                image_urls = [
+                    media.url for media in tweet.includes['media']
+                    if media.type == 'photo'
+                ]
+                return image_urls if image_urls else None
+        except Exception as e:
+            print(f"Error checking media: {e}")
+        return None
+
+    def download_image(self, image_url):
+        try:
+            response = http.get(image_url)
+            response.raise_for_status()
+            return response.content
+        except Exception as e:
+            print(f"Error downloading the image: {e}")
+            return None
+
+    def encode_image(self, image_content):
+        image_content, media_type = prepare_image(image_content)
+        return media_type, base64.b64encode(image_content).decode('utf-8')
+
+    def image_block(self, image):
+        media_type, image_base64 = image
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": image_base64
+            }
+        }
+
+    def analyze_image_with_claude(self, image, prompt=None, max_tokens=1000):
+        try:
+            response = self.claude_client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=max_tokens,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            self.image_block(image),
+                            {
+                                "type": "text",
+                                "text": prompt or self.image_prompt
+                            }
+                        ]
+                    }
+                ]
+            )
+            return response.content[0].text
+        except Exception as e:
+            print(f"Error analyzing an image: {e}")
+            return UNABLE_TO_ANALYZE
+
+    def analyze_combined_with_claude(self, images):
+        content = []
+        for i, image in enumerate(images):
+            content.append({"type": "text", "text": f"Image {i+1} :"})
+            content.append(self.image_block(image))
+        content.append({
+            "type": "text",
+            "text": f"{self.image_prompt}\n\nDo this for each of the {len(images)} images separately. Start each answer with a line \"Image N :\" where N is the image number, then the analysis."
+        })
+        try:
+            response = self.claude_client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=1000 * len(images),
+                messages=[{"role": "user", "content": content}]
+            )
+            text = response.content[0].text
+        except Exception as e:
+            print(f"Error analyzing the images: {e}")
+            return [UNABLE_TO_ANALYZE] * len(images)
+        parts = IMAGE_SECTION_PATTERN.split(text)
+        sections = {int(number): body.strip() for number, body in zip(parts[1::2], parts[2::2])}
+        if sorted(sections) != list(range(1, len(images) + 1)):
+            # Keep one analysis per image, in order, whatever the model did.
+            print("Combined image analysis did not follow the Image N : format, analyzing the images one by one.")
+            return list(self.executor.map(self.analyze_image_with_claude, images))
+        return [sections[i + 1] for i in range(len(images))]
+
+    def analyze_images_with_claude(self, images):
+        if self.mode == "combined" and len(images) > 1:
+            return self.analyze_combined_with_claude(images)
+        return list(self.executor.map(self.analyze_image_with_claude, images))
+
+    def cache_versions(self):
+        # Cached results valid under the current chart mode, full analyses
+        # first. Chart hint answers and detector readings are never served
+        # once their mode is turned off.
+        versions = [self.prompt_version]
+        if CHART_DETECTION in ("hint", "direct"):
+            versions.append(self.hint_version)
+        if CHART_DETECTION == "direct":
+            versions.append(self.direct_version)
+        return versions
+
+    def analyze_new_images(self, contents):
+        # Returns the analyses and the cache version each one was made with.
+        # Charts are read locally first. In "direct" mode a confident reading
+        # is the analysis; otherwise it goes to the model as a hint with a
+        # shorter prompt. Other images take the usual vision path.
+        readings = [None] * len(contents)
+        if CHART_DETECTION != "off":
+            readings = list(self.executor.map(read_chart, contents))
+        analyses = [None] * len(contents)
+        versions = [self.prompt_version] * len(contents)
+        charts = []
+        for i, reading in enumerate(readings):
+            if not reading:
+                continue
+            print(f"Chart detected locally: {reading.describe()}")
+            if CHART_DETECTION == "direct" and reading.is_direct(CHART_DIRECT_CONFIDENCE):
+                analyses[i] = reading.describe()
+                versions[i] = self.direct_version
+            else:
+                charts.append(i)
+                versions[i] = self.hint_version
+        pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+        encoded = dict(zip(pending, self.executor.map(self.encode_image, [contents[i] for i in pending])))
+        hinted = self.executor.map(
+            lambda i: self.analyze_image_with_claude(encoded[i], CHART_HINT_PROMPT.format(reading=readings[i].describe()), 400),
+            charts
+        )
+        for i, analysis in zip(charts, hinted):
+            if analysis.strip().upper().startswith(NOT_A_CHART):
+                # The model disagrees with the detector; use the normal prompt.
+                print("Vision model says the detected chart is not a chart.")
+                versions[i] = self.prompt_version
+                continue
+            analyses[i] = analysis
+        rest = [i for i in pending if analyses[i] is None]
+        if rest:
+            general = self.analyze_images_with_claude([encoded[i] for i in rest])
+            for i, analysis in zip(rest, general):
+                analyses[i] = analysis
+        return analyses, versions
+
+    def resolve_image(self, image_url):
+        # Returns (hash, bytes, cached analysis). A URL seen recently maps
+        # straight to its hash, so a cached image is not downloaded again.
+        digest = self.cache.hash_for_url(image_url)
+        if digest:
+            analysis = self.cache.get(digest, self.cache_versions(), from_url=True)
+            if analysis is not None:
+                return digest, None, analysis
+        image_content = self.download_image(image_url)
+        if not image_content:
+            return None
+        digest = content_hash(image_content)
+        self.cache.remember_url(image_url, digest)
+        return digest, image_content, self.cache.get(digest, self.cache_versions())
+
+    def hydrated_image_urls(self, tweet):
+        # None when the tweet has media we never saw expanded.
+        media_keys = (tweet.get('attachments') or {}).get('media_keys') or []
+        with self.includes_lock:
+            media = [self.media.get(media_key) for media_key in media_keys]
+        if None in media:
+            return None
+        return [m['url'] for m in media if m['type'] == 'photo' and m.get('url')]
+
+    def process_known_tweet(self, tweet):
+        image_urls = self.hydrated_image_urls(tweet)
+        if image_urls is None:
+            return self.process_tweet_image(tweet['id'])
+        return self.analyze_image_urls(image_urls)
+
+    def process_hydrated_tweet(self, tweet, includes=None, referenced_types=()):
+        # Looks at the tweet itself, then at the first referenced tweet of
+        # each type in referenced_types ("replied_to", "quoted").
+        self.remember_includes(includes)
+        image_analysis = self.process_known_tweet(tweet)
+        for ref in tweet.get('referenced_tweets') or []:
+            if image_analysis:
+                break
+            if ref['type'] not in referenced_types:
+                continue
+            with self.includes_lock:
+                referenced = self.tweets.get(str(ref['id']))
+            image_analysis = self.process_known_tweet(referenced) if referenced else self.process_tweet_image(ref['id'])
+            if image_analysis:
+                print(f"Image found in the {ref['type']} tweet.")
+        return image_analysis
+
+    def process_tweet_image(self, tweet_id):
+        return self.analyze_image_urls(self.check_tweet_media(tweet_id))
+
+    def analyze_image_urls(self, image_urls):
+        if not image_urls:
+            return None
+        image_urls = [media_variant_url(image_url) for image_url in image_urls]
+        images = [image for image in self.executor.map(self.resolve_image, image_urls) if image]
+        if not images:
+            return None
+        analyses = [analysis for _, _, analysis in images]
+        misses = [i for i, analysis in enumerate(analyses) if analysis is None]
+        if misses:
+            fresh, versions = self.analyze_new_images([images[i][1] for i in misses])
+            for i, analysis, version in zip(misses, fresh, versions):
+                analyses[i] = analysis
+                if analysis != UNABLE_TO_ANALYZE:
+                    self.cache.put(images[i][0], version, analysis)
+        print(f"Image analysis cache: {self.cache.describe()}")
+        if len(analyses) == 1:
+            return analyses[0]
+        else:
+            return "\n\n".join([f"Image {i+1} :\n{analyse}" for i, analyse in enumerate(analyses)])
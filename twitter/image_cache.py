@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", "image_cache.db")
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "5000"))
+IMAGE_URL_TTL = int(os.getenv("IMAGE_URL_TTL", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    analysis TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_last_used ON analyses (last_used);
+"""
+
+def content_hash(image_content):
+    return hashlib.sha256(image_content).hexdigest()
+
+def prompt_version(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+class ImageAnalysisCache:
+    def __init__(self, path=IMAGE_CACHE_PATH, max_entries=IMAGE_CACHE_MAX_ENTRIES, url_ttl=IMAGE_URL_TTL):
+        self.max_entries = max_entries
+        self.url_ttl = url_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.urls = {}
+        self.hits = 0
+        self.misses = 0
+        self.url_hits = 0
+
+    def hash_for_url(self, url):
+        now = time.time()
+        with self.lock:
+            entry = self.urls.get(url)
+            if entry is None:
+                return None
+            if now - entry[1] > self.url_ttl:
+                del self.urls[url]
+                return None
+            return entry[0]
+
+    def remember_url(self, url, digest):
+        now = time.time()
+        with self.lock:
+            self.urls[url] = (digest, now)
+            for stale in [u for u, (_, seen) in self.urls.items() if now - seen > self.url_ttl]:
+                del self.urls[stale]
+
+    def get(self, digest, versions, from_url=False):
+        # versions lists every prompt version acceptable to the caller, in
+        # order of preference; the first one cached wins.
+        with self.lock:
+            row = None
+            for version in versions:
+                key = f"{digest}:{version}"
+                row = self.conn.execute("SELECT analysis FROM analyses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    break
+            if row is None:
+                if not from_url:
+                    self.misses += 1
+                return None
+            self.conn.execute("UPDATE analyses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            if from_url:
+                self.url_hits += 1
+            return row[0]
+
+    def put(self, digest, version, analysis):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, analysis, last_used) VALUES (?, ?, ?)",
+                (f"{digest}:{version}", analysis, time.time())
+            )
+            self.conn.execute(
+                "DELETE FROM analyses WHERE key IN (SELECT key FROM analyses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def describe(self):
+        with self.lock:
+            total = self.hits + self.misses
+            rate = f"{self.hits / total:.0%}" if total else "n/a"
+            return f"{self.hits} hits ({self.url_hits} without download), {self.misses} misses, hit rate {rate}"
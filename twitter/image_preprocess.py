@@ -0,0 +1,59 @@
+import io
+import os
+import re
+from PIL import Image
+
+# Claude downsizes anything with a long edge above ~1568px itself, so sending
+# more pixels than that only makes the upload and the first token slower.
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+SUPPORTED_MEDIA_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+# Named sizes served by pbs.twimg.com, with the long edge they are capped at.
+TWITTER_VARIANTS = [("small", 680), ("medium", 1200), ("large", 2048)]
+TWITTER_MEDIA_URL = re.compile(r"^(https://pbs\.twimg\.com/media/[^.?]+)\.(\w+)")
+
+def media_variant_url(url, max_edge=IMAGE_MAX_EDGE):
+    # Smallest variant whose long edge still covers max_edge. Variants never
+    # upscale, so a small original comes back unchanged.
+    match = TWITTER_MEDIA_URL.match(url)
+    if not match:
+        return url
+    base, extension = match.groups()
+    name = next((name for name, edge in TWITTER_VARIANTS if edge >= max_edge), "orig")
+    return f"{base}?format={extension}&name={name}"
+
+def sniff_media_type(image_content):
+    if image_content.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if image_content.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_content[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if image_content[:4] == b"RIFF" and image_content[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def prepare_image(image_content, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_JPEG_QUALITY):
+    # Returns (bytes, media_type) ready for a vision request. Images that are
+    # already small and in a supported format are passed through untouched.
+    media_type = sniff_media_type(image_content)
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        if media_type in SUPPORTED_MEDIA_TYPES and max(image.size) <= max_edge:
+            return image_content, media_type
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue(), "image/jpeg"
+    except Exception as e:
+        print(f"Error preparing the image: {e}")
+        return image_content, media_type or "image/jpeg"
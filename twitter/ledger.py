@@ -0,0 +1,172 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+
+LEDGER_PATH = os.getenv("LEDGER_PATH", "reply.db")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    main_tweet_id TEXT,
+    tweet_id_tagging_bot TEXT,
+    username TEXT,
+    timestamp TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_main_tweet_id ON responses (main_tweet_id);
+CREATE INDEX IF NOT EXISTS idx_responses_tweet_id_tagging_bot ON responses (tweet_id_tagging_bot);
+CREATE INDEX IF NOT EXISTS idx_responses_username_timestamp ON responses (username, timestamp);
+CREATE TABLE IF NOT EXISTS relevance_labels (
+    tweet_id TEXT NOT NULL,
+    policy TEXT NOT NULL,
+    text TEXT NOT NULL,
+    relevant INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (tweet_id, policy)
+);
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+"""
+
+def format_timestamp(dt):
+    return dt.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+def parse_timestamp(timestamp_str):
+    return datetime.strptime(timestamp_str, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+def _id(value):
+    return None if value is None else str(value)
+
+class ResponseLedger:
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def _row(self, data):
+        data = dict(data)
+        data.setdefault("timestamp", format_timestamp(datetime.now(timezone.utc)))
+        return (
+            _id(data.get("main_tweet_id")),
+            _id(data.get("tweet_id_tagging_bot")),
+            data.get("username"),
+            data["timestamp"],
+            json.dumps(data)
+        )
+
+    def record(self, data):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO responses (main_tweet_id, tweet_id_tagging_bot, username, timestamp, record) VALUES (?, ?, ?, ?, ?)",
+                self._row(data)
+            )
+            self.conn.commit()
+
+    def _exists(self, column, value):
+        with self.lock:
+            row = self.conn.execute(f"SELECT 1 FROM responses WHERE {column} = ? LIMIT 1", (_id(value),)).fetchone()
+        return row is not None
+
+    def has_main_tweet(self, main_tweet_id):
+        return self._exists("main_tweet_id", main_tweet_id)
+
+    def has_tweet(self, tweet_id):
+        return self._exists("tweet_id_tagging_bot", tweet_id)
+
+    def count_responses(self, username, since):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM responses WHERE username = ? AND timestamp >= ?",
+                (username, format_timestamp(since))
+            ).fetchone()
+        return row[0]
+
+    def last_response_time(self, username):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT MAX(timestamp) FROM responses WHERE username = ?",
+                (username,)
+            ).fetchone()
+        return parse_timestamp(row[0]) if row[0] else None
+
+    def responses_since(self, since):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT username, timestamp FROM responses WHERE timestamp >= ? ORDER BY timestamp",
+                (format_timestamp(since),)
+            ).fetchall()
+        return [(username, parse_timestamp(timestamp)) for username, timestamp in rows if username]
+
+    def records(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT record FROM responses ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def record_label(self, tweet_id, policy, text, relevant):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO relevance_labels (tweet_id, policy, text, relevant, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (_id(tweet_id), policy, text, int(bool(relevant)), format_timestamp(datetime.now(timezone.utc)))
+            )
+            self.conn.commit()
+
+    def labels(self, policy):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT tweet_id, text, relevant FROM relevance_labels WHERE policy = ? ORDER BY timestamp",
+                (policy,)
+            ).fetchall()
+        return [(tweet_id, text, bool(relevant)) for tweet_id, text, relevant in rows]
+
+    def import_json(self, filename):
+        key = os.path.abspath(filename)
+        if not os.path.exists(filename):
+            return 0
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM imports WHERE path = ?", (key,)).fetchone():
+                return 0
+        with open(filename, 'r', encoding='utf-8') as file:
+            try:
+                existing_data = json.load(file)
+            except json.JSONDecodeError:
+                print(f"{filename} is empty or invalid. Nothing to import.")
+                existing_data = []
+        rows = [self._row(entry) for entry in existing_data if isinstance(entry, dict)]
+        # Every bot imports at startup, so claim the file and copy its rows in
+        # one write transaction; a bot that loses the race imports nothing.
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                claimed = self.conn.execute(
+                    "INSERT OR IGNORE INTO imports (path, imported_at, count) VALUES (?, ?, ?)",
+                    (key, format_timestamp(datetime.now(timezone.utc)), len(rows))
+                ).rowcount
+                if not claimed:
+                    self.conn.rollback()
+                    return 0
+                self.conn.executemany(
+                    "INSERT INTO responses (main_tweet_id, tweet_id_tagging_bot, username, timestamp, record) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        print(f"Imported {len(rows)} responses from {filename} into {self.path}.")
+        return len(rows)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python ledger.py <reply.json> [ledger.db]")
+        sys.exit(1)
+    ResponseLedger(sys.argv[2] if len(sys.argv) > 2 else LEDGER_PATH).import_json(sys.argv[1])
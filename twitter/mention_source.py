@@ -0,0 +1,140 @@
+import json
+import os
+import queue
+import threading
+import time
+from poll_scheduler import PollScheduler
+from common.transport import http
+
+TWITTER_API_BASE_URL = os.getenv("TWITTER_API_BASE_URL", "https://api.twitter.com")
+STREAM_READ_TIMEOUT = 90
+STREAM_MAX_BACKOFF = 320
+
+def newest_id(tweets):
+    return max((tweet['id'] for tweet in tweets), key=int)
+
+class StreamError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code} {text}")
+        self.status_code = status_code
+        self.text = text
+
+class PollingMentionSource:
+    def __init__(self, search, scheduler=None):
+        self.search = search
+        self.scheduler = scheduler or PollScheduler()
+        self.since_id = None
+
+    def run(self, handle_batch):
+        while True:
+            try:
+                print("Checking for new tweets...")
+                tweets = self.search(self.since_id)
+                if tweets:
+                    handle_batch(tweets)
+                    self.since_id = newest_id(tweets)
+                else:
+                    print("No relevant tweets found.")
+                self.scheduler.record(bool(tweets))
+            except Exception as e:
+                print(f"Error encountered: {e}")
+                self.scheduler.record_error()
+            delay = self.scheduler.next_delay()
+            print(f"Waiting for {delay:.0f} seconds before checking again ({self.scheduler.describe()})...")
+            time.sleep(delay)
+
+class StreamingMentionSource:
+    def __init__(self, bearer_token, rule, params, catch_up=None, on_includes=None, base_url=TWITTER_API_BASE_URL):
+        self.rule = rule
+        self.params = params
+        self.catch_up = catch_up
+        self.on_includes = on_includes
+        self.base_url = base_url.rstrip('/')
+        self.headers = {"Authorization": f"Bearer {bearer_token}"}
+        self.since_id = None
+        self.pending = queue.Queue()
+
+    def sync_rules(self):
+        url = f"{self.base_url}/2/tweets/search/stream/rules"
+        response = http.get(url, headers=self.headers, timeout=30)
+        response.raise_for_status()
+        rules = response.json().get('data', [])
+        if any(rule.get('value') == self.rule for rule in rules):
+            return
+        response = http.post(url, headers=self.headers, json={"add": [{"value": self.rule, "tag": "lea mentions"}]}, timeout=30)
+        response.raise_for_status()
+        print(f"Stream rule added: {self.rule}")
+
+    def _enqueue(self, tweets):
+        # The reader only queues tweets; handling them (author lookups,
+        # waiting for pipeline capacity) happens on the handler thread, so a
+        # backed-up pipeline never stops the stream from being read.
+        self.pending.put(tweets)
+        newest = newest_id(tweets)
+        if self.since_id is None or int(newest) > int(self.since_id):
+            self.since_id = newest
+
+    def _drain(self, handle_batch):
+        while True:
+            tweets = self.pending.get()
+            while True:
+                try:
+                    tweets = tweets + self.pending.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                handle_batch(tweets)
+            except Exception as e:
+                print(f"Error handling streamed mentions: {e}")
+
+    def _catch_up(self):
+        if not self.catch_up or not self.since_id:
+            return
+        tweets = self.catch_up(self.since_id)
+        if tweets:
+            print(f"Recovered {len(tweets)} mentions missed while the stream was down.")
+            self._enqueue(tweets)
+
+    def _read_stream(self):
+        url = f"{self.base_url}/2/tweets/search/stream"
+        with http.get(url, headers=self.headers, params=self.params, stream=True, timeout=(10, STREAM_READ_TIMEOUT)) as response:
+            if response.status_code != 200:
+                raise StreamError(response.status_code, response.text)
+            print("Connected to the mention stream.")
+            yield None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                payload = json.loads(line)
+                if 'data' not in payload:
+                    print(f"Stream message ignored: {payload}")
+                    continue
+                if self.on_includes and 'includes' in payload:
+                    self.on_includes(payload['includes'])
+                yield payload['data']
+
+    def run(self, handle_batch):
+        threading.Thread(target=self._drain, args=(handle_batch,), name="mention-handler", daemon=True).start()
+        backoff = 1
+        rules_synced = False
+        while True:
+            try:
+                if not rules_synced:
+                    self.sync_rules()
+                    rules_synced = True
+                for tweet in self._read_stream():
+                    if tweet is None:
+                        backoff = 1
+                        self._catch_up()
+                        continue
+                    self._enqueue([tweet])
+                print("Mention stream closed by the server.")
+            except StreamError as e:
+                print(f"Stream returned an error: {e.status_code} {e.text}")
+                if e.status_code == 429:
+                    backoff = max(backoff, 60)
+            except Exception as e:
+                print(f"Stream connection error: {e}")
+            print(f"Reconnecting to the mention stream in {backoff} seconds...")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, STREAM_MAX_BACKOFF)
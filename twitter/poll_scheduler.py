@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+POLL_MIN_DELAY = float(os.getenv("POLL_MIN_DELAY", "5"))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", "120"))
+POLL_DEFAULT_DELAY = float(os.getenv("POLL_DEFAULT_DELAY", "20"))
+POLL_RESERVE_REQUESTS = int(os.getenv("POLL_RESERVE_REQUESTS", "2"))
+
+# Multiplier on the even spacing: polls that found mentions pull it down,
+# empty polls push it back up.
+BUSY_FACTOR = 0.5
+IDLE_FACTOR = 3.0
+IDLE_STEP = 1.5
+
+class PollScheduler:
+    def __init__(self, min_delay=POLL_MIN_DELAY, max_delay=POLL_MAX_DELAY, default_delay=POLL_DEFAULT_DELAY, reserve=POLL_RESERVE_REQUESTS):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.default_delay = default_delay
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.factor = 1.0
+        self.errors = 0
+
+    def observe(self, response):
+        headers = response.headers
+        with self.lock:
+            try:
+                if 'x-rate-limit-limit' in headers:
+                    self.limit = int(headers['x-rate-limit-limit'])
+                if 'x-rate-limit-remaining' in headers:
+                    self.remaining = int(headers['x-rate-limit-remaining'])
+                if 'x-rate-limit-reset' in headers:
+                    self.reset_at = float(headers['x-rate-limit-reset'])
+            except ValueError as e:
+                print(f"Ignoring malformed rate limit headers: {e}")
+            if response.status_code == 429:
+                self.remaining = 0
+                if self.reset_at is None or self.reset_at <= time.time():
+                    self.reset_at = time.time() + 15 * 60
+
+    def record(self, found):
+        with self.lock:
+            self.errors = 0
+            if found:
+                self.factor = BUSY_FACTOR
+            else:
+                self.factor = min(max(self.factor, 1.0) * IDLE_STEP, IDLE_FACTOR)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def next_delay(self):
+        with self.lock:
+            now = time.time()
+            if self.reset_at is not None and self.reset_at <= now:
+                self.remaining = self.limit
+                self.reset_at = None
+            if self.remaining is not None and self.reset_at is not None:
+                usable = self.remaining - self.reserve
+                if usable <= 0:
+                    return self.reset_at - now + 1
+                even = (self.reset_at - now) / usable
+            else:
+                even = self.default_delay
+            if self.errors:
+                delay = min(max(even, self.default_delay) * 2 ** self.errors, 480)
+            else:
+                delay = min(max(even * self.factor, self.min_delay), self.max_delay)
+            return delay
+
+    def describe(self):
+        with self.lock:
+            if self.remaining is None or self.reset_at is None:
+                return "rate limit unknown"
+            return f"{self.remaining}/{self.limit} requests left, window resets in {max(0, int(self.reset_at - time.time()))}s"
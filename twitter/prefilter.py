@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import random
+import re
+import sys
+import zlib
+from ledger import ResponseLedger, LEDGER_PATH
+
+PREFILTER_THRESHOLD = float(os.getenv("PREFILTER_THRESHOLD", "0.9"))
+PREFILTER_AUDIT_RATE = float(os.getenv("PREFILTER_AUDIT_RATE", "0.05"))
+PREFILTER_BUCKETS = 2 ** 18
+PREFILTER_MODEL_PATH = os.getenv("PREFILTER_MODEL_PATH", "prefilter_{policy}.json")
+
+URL_PATTERN = re.compile(r"https?://\S+")
+TOKEN_PATTERN = re.compile(r"[a-z0-9$#@']+")
+TOPIC_PATTERN = re.compile(
+    r"\b(crypto|bitcoin|btc|eth|ethereum|solana|doge|memecoins?|shitcoins?|nfts?|blockchain|defi|airdrop|altcoins?|"
+    r"trump|putin|zelensky|macron|"
+    r"agi|llms?|gpt-?\d|chatgpt|openai|machine learning|neural networks?|ai agents?)\b",
+    re.IGNORECASE
+)
+AI_PATTERN = re.compile(r"\bA\.?I\b")
+CASHTAG_PATTERN = re.compile(r"(?<![\w$])\$[A-Z][A-Z0-9]{1,9}\b")
+
+def has_text_to_answer(text):
+    stripped = re.sub(r"[@#]\w+", "", URL_PATTERN.sub("", text))
+    return len(re.findall(r"\w{2,}", stripped)) >= 2
+
+# Confident answers from rules alone: True/False, or None to let the model decide.
+LEXICONS = {
+    "topics": lambda text: True if TOPIC_PATTERN.search(text) or AI_PATTERN.search(text) or CASHTAG_PATTERN.search(text) else None,
+    "respondable": lambda text: None if has_text_to_answer(text) else False,
+}
+
+def features(text, buckets=PREFILTER_BUCKETS):
+    tokens = TOKEN_PATTERN.findall(URL_PATTERN.sub(" xurlx ", text.lower()))
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    counts = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % buckets
+        counts[index] = counts.get(index, 0) + 1
+    return counts
+
+class HashedLinearModel:
+    def __init__(self, weights=None, bias=0.0, buckets=PREFILTER_BUCKETS):
+        self.weights = weights or {}
+        self.bias = bias
+        self.buckets = buckets
+
+    def predict(self, text):
+        score = self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features(text, self.buckets).items())
+        return 1 / (1 + math.exp(-max(min(score, 30), -30)))
+
+    def fit(self, samples, epochs=8, learning_rate=0.2, l2=1e-4):
+        samples = list(samples)
+        rng = random.Random(0)
+        for _ in range(epochs):
+            rng.shuffle(samples)
+            for text, label in samples:
+                x = features(text, self.buckets)
+                error = self.predict(text) - (1.0 if label else 0.0)
+                self.bias -= learning_rate * error
+                for i, v in x.items():
+                    w = self.weights.get(i, 0.0)
+                    self.weights[i] = w - learning_rate * (error * v + l2 * w)
+        return self
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"buckets": self.buckets, "bias": self.bias, "weights": {str(i): w for i, w in self.weights.items() if abs(w) > 1e-6}}, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return cls({int(i): w for i, w in data["weights"].items()}, data["bias"], data["buckets"])
+
+class Prefilter:
+    def __init__(self, policy, model=None, threshold=PREFILTER_THRESHOLD, audit_rate=PREFILTER_AUDIT_RATE):
+        self.policy = policy
+        self.lexicon = LEXICONS.get(policy, lambda text: None)
+        self.model = model
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+
+    def should_audit(self):
+        # A share of local decisions still goes to Claude, so the stored
+        # labels cover the lexicon and the model, not only ambiguous tweets.
+        return random.random() < self.audit_rate
+
+    @classmethod
+    def load(cls, policy, threshold=PREFILTER_THRESHOLD):
+        path = PREFILTER_MODEL_PATH.format(policy=policy)
+        model = HashedLinearModel.load(path) if os.path.exists(path) else None
+        if model is None:
+            print(f"No pre-filter model at {path}, using the {policy} lexicon only.")
+        return cls(policy, model, threshold)
+
+    def decide(self, text):
+        verdict = self.lexicon(text)
+        if verdict is not None or self.model is None:
+            return verdict
+        probability = self.model.predict(text)
+        if probability >= self.threshold:
+            return True
+        if probability <= 1 - self.threshold:
+            return False
+        return None
+
+def training_samples(ledger, policy):
+    samples = {tweet_id: (text, relevant) for tweet_id, text, relevant in ledger.labels(policy)}
+    if policy == "respondable":
+        # Every public tweet we replied to had something to answer.
+        for record in ledger.records():
+            tweet_id = record.get("tweet_id_tagging_bot")
+            if record.get("main_tweet_id") is None and record.get("tweet_text_received") and tweet_id not in samples:
+                samples[tweet_id] = (record["tweet_text_received"], True)
+    return samples
+
+def evaluate_lexicon(samples, policy):
+    lexicon = LEXICONS.get(policy, lambda text: None)
+    counts = {"yes": [0, 0], "no": [0, 0]}
+    for text, label in samples.values():
+        verdict = lexicon(text)
+        if verdict is not None:
+            counts["yes" if verdict else "no"][verdict == label] += 1
+    for answer, (wrong, right) in counts.items():
+        if wrong + right:
+            print(f"Lexicon {answer}: {right}/{wrong + right} agree with Claude (precision {right / (wrong + right):.3f})")
+
+def evaluate(samples, policy, threshold):
+    holdout = {tweet_id for tweet_id in samples if zlib.crc32(str(tweet_id).encode("utf-8")) % 5 == 0}
+    model = HashedLinearModel().fit(sample for tweet_id, sample in samples.items() if tweet_id not in holdout)
+    prefilter = Prefilter(policy, model, threshold)
+    counts = {"tp": 0, "fp": 0, "tn": 0, "fn": 0, "ambiguous": 0}
+    positives = 0
+    negatives = 0
+    for tweet_id in holdout:
+        text, label = samples[tweet_id]
+        positives += label
+        negatives += not label
+        verdict = prefilter.decide(text)
+        if verdict is None:
+            counts["ambiguous"] += 1
+        elif verdict:
+            counts["tp" if label else "fp"] += 1
+        else:
+            counts["fn" if label else "tn"] += 1
+    decided = len(holdout) - counts["ambiguous"]
+    ratio = lambda a, b: f"{a / b:.3f}" if b else "n/a"
+    print(f"Policy {policy}, threshold {threshold}: {len(samples) - len(holdout)} training / {len(holdout)} held-out tweets")
+    print(f"Decided locally: {decided}/{len(holdout)} ({ratio(decided, len(holdout))}), LLM calls saved")
+    print(f"yes: precision {ratio(counts['tp'], counts['tp'] + counts['fp'])}, recall {ratio(counts['tp'], positives)}")
+    print(f"no:  precision {ratio(counts['tn'], counts['tn'] + counts['fn'])}, recall {ratio(counts['tn'], negatives)}")
+    print(f"Relevant tweets dropped without an LLM check: {counts['fn']}")
+    evaluate_lexicon(samples, policy)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("train", "eval"):
+        print("Usage: python prefilter.py train|eval <policy> [threshold] [ledger.db]")
+        sys.exit(1)
+    command, policy = sys.argv[1], sys.argv[2]
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else PREFILTER_THRESHOLD
+    samples = training_samples(ResponseLedger(sys.argv[4] if len(sys.argv) > 4 else LEDGER_PATH), policy)
+    if not samples:
+        print(f"No labelled tweets for policy {policy} yet.")
+        sys.exit(1)
+    if command == "eval":
+        evaluate(samples, policy, threshold)
+    else:
+        path = PREFILTER_MODEL_PATH.format(policy=policy)
+        HashedLinearModel().fit(samples.values()).save(path)
+        print(f"Trained on {len(samples)} tweets, model saved to {path}.")
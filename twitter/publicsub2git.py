@@ -1,103 +1,34 @@
-import requests
 import anthropic
 import tweepy
 from requests_oauthlib import OAuth1
 import time
 import os
+import sys
 from datetime import datetime, timedelta, timezone
 import random
-import json
 import re
-import base64
 import cloudinary
 import cloudinary.uploader
 from anthropic import Anthropic
+import threading
 from tweepy.errors import TooManyRequests, TweepyException
-
-class TwitterImageAnalyzer:
-    def __init__(self, bearer_token, claude_api_key):
-        self.twitter_client = tweepy.Client(bearer_token=bearer_token)
-        self.claude_client = anthropic.Anthropic(api_key=claude_api_key)
-
-    def check_tweet_media(self, tweet_url):
-        try:
-            tweet_id = tweet_url.split('/')[-1]
-            tweet = self.twitter_client.get_tweet(
-                id=tweet_id, 
-                expansions=['attachments.media_keys'],
-                media_fields=['url', 'type']
-            )
-            if tweet.includes and 'media' in tweet.includes:
-                image_urls = [
-                    media.url for media in tweet.includes['media']
-                    if media.type == 'photo'
-                ]
-                return image_urls if image_urls else None
-        except Exception as e:
-            print(f"Error checking media: {e}")
-        return None
-
-    def download_image(self, image_url):
-        try:
-            response = requests.get(image_url)
-            response.raise_for_status()
-            return response.content
-        except Exception as e:
-            print(f"Error downloading the image: {e}")
-            return None
-
-    def encode_image_base64(self, image_content):
-        return base64.b64encode(image_content).decode('utf-8')
-
-    def analyze_images_with_claude(self, image_base64_list):
-        analyses = []
-        for image_base64 in image_base64_list:
-            try:
-                response = self.claude_client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1000,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": image_base64
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "Describe precisely what you see in this image. Be detailed and objective. And give your opinion. If there are numbers associated to some token or nft, regroup them together. If it's a chart, check if there's a big red candle at the end (scam), or big green (bullish). Otherwise, just describe. Always be precise."
-                                }
-                            ]
-                        }
-                    ]
-                )
-                analyses.append(response.content[0].text)
-            except Exception as e:
-                print(f"Error analyzing an image: {e}")
-                analyses.append("Unable to analyze this image")
-        return analyses
-
-    def process_tweet_image(self, tweet_url):
-        image_urls = self.check_tweet_media(tweet_url)
-        if not image_urls:
-            return None
-        image_base64_list = []
-        for image_url in image_urls:
-            image_content = self.download_image(image_url)
-            if image_content:
-                image_base64_list.append(self.encode_image_base64(image_content))
-        if not image_base64_list:
-            return None
-        analyses = self.analyze_images_with_claude(image_base64_list)
-        if len(analyses) == 1:
-            return analyses[0]
-        else:
-            return "\n\n".join([f"Image {i+1} :\n{analyse}" for i, analyse in enumerate(analyses)])
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from image_analyzer import TwitterImageAnalyzer
+from user_cache import UsernameCache
+from ledger import ResponseLedger
+from timeline_fanout import TimelineFanout, TIMELINE_REQUEST_TIMEOUT
+from watchlist import Watchlist, dedupe_usernames
+from watchlist_search import MEDIA_FIELDS, TWEET_EXPANSIONS, TWEET_FIELDS, search_watchlist
+from relevance import RelevanceClassifier, POLICIES
+from prefilter import Prefilter
+from candidates import CandidateScheduler
+from cooldowns import CooldownTracker
+from common.persona import PersonaStore
+from common.transport import http, TimeoutSession, HTTP_CONNECT_TIMEOUT
+from common.prompt_cache import cached_system, prompt_cache_stats, warn_if_uncacheable
+from common.pipeline import Pipeline, Stage, claude_limit, stage_workers
+
+IMAGE_ANALYSIS_PROMPT = "Describe precisely what you see in this image. Be detailed and objective. And give your opinion. If there are numbers associated to some token or nft, regroup them together. If it's a chart, check if there's a big red candle at the end (scam), or big green (bullish). Otherwise, just describe. Always be precise."
 
 api_key = os.environ["TWITTER_API_KEY"]
 api_secret = os.environ["TWITTER_API_SECRET"]
@@ -106,8 +37,10 @@ access_token = os.environ["TWITTER_ACCESS_TOKEN"]
 access_token_secret = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
 
 client = tweepy.Client(bearer_token, api_key, api_secret, access_token, access_token_secret)
+client.session = TimeoutSession((HTTP_CONNECT_TIMEOUT, TIMELINE_REQUEST_TIMEOUT))
 auth = tweepy.OAuth1UserHandler(api_key, api_secret, access_token, access_token_secret)
 api = tweepy.API(auth)
+user_cache = UsernameCache()
 
 movement_api_key = os.environ["MOVEMENT_API_KEY"]
 photo_url = "https://s11.gifyu.com/images/SyFer.png"
@@ -119,70 +52,31 @@ outline_colour = "&H00da77da"
 def create_auth():
     return OAuth1(api_key, api_secret, access_token, access_token_secret)
 
-claude_client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
-image_analyzer = TwitterImageAnalyzer(bearer_token, os.environ["ANTHROPIC_API_KEY"])
+claude_client = claude_limit.wrap(anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
+image_analyzer = TwitterImageAnalyzer(bearer_token, os.environ["ANTHROPIC_API_KEY"], IMAGE_ANALYSIS_PROMPT)
+
+persona_store = PersonaStore(42).reload_on_sighup()
+warn_if_uncacheable(persona_store.get())
 
 def generate_text_with_claude(prompt, image_description=None):
     print("Generating response using Claude API...")
-    character_context = (
-        os.environ["CHARACTER_CONTEXT_LINE_1"] +
-        os.environ["CHARACTER_CONTEXT_LINE_2"] +
-        os.environ["CHARACTER_CONTEXT_LINE_3"] +
-        os.environ["CHARACTER_CONTEXT_LINE_4"] +
-        os.environ["CHARACTER_CONTEXT_LINE_5"] +
-        os.environ["CHARACTER_CONTEXT_LINE_6"] +
-        os.environ["CHARACTER_CONTEXT_LINE_7"] +
-        os.environ["CHARACTER_CONTEXT_LINE_8"] +
-        os.environ["CHARACTER_CONTEXT_LINE_9"] +
-        os.environ["CHARACTER_CONTEXT_LINE_10"] +
-        os.environ["CHARACTER_CONTEXT_LINE_11"] +
-        os.environ["CHARACTER_CONTEXT_LINE_12"] +
-        os.environ["CHARACTER_CONTEXT_LINE_13"] +
-        os.environ["CHARACTER_CONTEXT_LINE_14"] +
-        os.environ["CHARACTER_CONTEXT_LINE_15"] +
-        os.environ["CHARACTER_CONTEXT_LINE_16"] +
-        os.environ["CHARACTER_CONTEXT_LINE_17"] +
-        os.environ["CHARACTER_CONTEXT_LINE_18"] +
-        os.environ["CHARACTER_CONTEXT_LINE_19"] +
-        os.environ["CHARACTER_CONTEXT_LINE_20"] +
-        os.environ["CHARACTER_CONTEXT_LINE_21"] +
-        os.environ["CHARACTER_CONTEXT_LINE_22"] +
-        os.environ["CHARACTER_CONTEXT_LINE_23"] +
-        os.environ["CHARACTER_CONTEXT_LINE_24"] +
-        os.environ["CHARACTER_CONTEXT_LINE_25"] +
-        os.environ["CHARACTER_CONTEXT_LINE_26"] +
-        os.environ["CHARACTER_CONTEXT_LINE_27"] +
-        os.environ["CHARACTER_CONTEXT_LINE_28"] +
-        os.environ["CHARACTER_CONTEXT_LINE_29"] +
-        os.environ["CHARACTER_CONTEXT_LINE_30"] +
-        os.environ["CHARACTER_CONTEXT_LINE_31"] +
-        os.environ["CHARACTER_CONTEXT_LINE_32"] +
-        os.environ["CHARACTER_CONTEXT_LINE_33"] +
-        os.environ["CHARACTER_CONTEXT_LINE_34"] +
-        os.environ["CHARACTER_CONTEXT_LINE_35"] +
-        os.environ["CHARACTER_CONTEXT_LINE_36"] +
-        os.environ["CHARACTER_CONTEXT_LINE_37"] +
-        os.environ["CHARACTER_CONTEXT_LINE_38"] +
-        os.environ["CHARACTER_CONTEXT_LINE_39"] +
-        os.environ["CHARACTER_CONTEXT_LINE_40"] +
-        os.environ["CHARACTER_CONTEXT_LINE_41"] +
-        os.environ["CHARACTER_CONTEXT_LINE_42"]
-    )
     if image_description:
         full_prompt = (
-            f"{character_context}\n\n{prompt}\n\n"
+            f"{prompt}\n\n"
             f"Note: A detailed analysis of the image is available. Use this analysis if relevant and asked, or to support your answer. Only if needed use the image analysis.\n\n"
             f"Image analysis:\n{image_description}"
         )
     else:
-        full_prompt = f"{character_context}\n{prompt}"
+        full_prompt = prompt
     response = claude_client.messages.create(
         model="claude-3-5-sonnet-20241022",
         max_tokens=800,
+        system=cached_system(persona_store.get()),
         messages=[
             {"role": "user", "content": full_prompt}
         ]
     )
+    prompt_cache_stats.record(response)
     generated_text = response.content[0].text
     print(generated_text)
     return generated_text.strip()
@@ -205,7 +99,7 @@ def upload_audio_to_cloudinary(file_path):
 elevenlabs_api_key = os.environ["ELEVEN_LABS_API_KEY"]
 voice_id = os.environ["ELEVEN_LABS_VOICE_ID"]
 
-def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key):
+def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key, audio_file_path="audio_output.mp3"):
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
     headers = {
         "Accept": "audio/mpeg",
@@ -222,14 +116,14 @@ def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key):
             "stability": 0
         }
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = http.post(url, json=data, headers=headers)
     if response.status_code == 200:
         try:
-            audio_file_path = "audio_output.mp3"
             with open(audio_file_path, "wb") as audio_file:
                 audio_file.write(response.content)
-            print("The audio has been saved under the name 'audio_output.mp3'.")
+            print(f"The audio has been saved under the name '{audio_file_path}'.")
             uploaded_audio_url = upload_audio_to_cloudinary(audio_file_path)
+            os.remove(audio_file_path)
             if uploaded_audio_url:
                 print("Audio uploaded successfully!")
                 return uploaded_audio_url
@@ -260,7 +154,7 @@ class AIAvatarCreator:
             "watermark": 0,
             "useSr": False
         }
-        response = requests.post(url, json=data, headers=self.headers)
+        response = http.post(url, json=data, headers=self.headers)
         if response.status_code == 200:
             result = response.json()
             project_id = result["data"]["id"]
@@ -274,7 +168,7 @@ class AIAvatarCreator:
         print("Waiting for avatar video to be ready...")
         url = f"{os.getenv('MOVEMENT_PROJECT_URL')}/{project_id}"
         for i in range(max_retries):
-            response = requests.get(url, headers=self.headers)
+            response = http.get(url, headers=self.headers)
             if response.status_code == 200:
                 result = response.json()
                 video_url = result["data"]["videoUrl"]
@@ -303,53 +197,24 @@ def upload_and_post_video_v2(local_video_path, tweet_id, summary_text):
         print(f"Exception occurred during media upload: {e}")
         return None
 
-def save_tweet_data_to_json(data, filename="reply.json"):
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            try:
-                existing_data = json.load(file)
-            except json.JSONDecodeError:
-                print("JSON file is empty or invalid. Starting fresh.")
-                existing_data = []
-    else:
-        existing_data = []
+ledger = ResponseLedger()
+ledger.import_json("reply.json")
+
+def save_tweet_data(data):
     data["tweet_id_tagging_bot"] = data.get("tweet_id_tagging_bot", "unknown")
     data["username"] = data.get("username", "unknown")
-    data["timestamp"] = data.get("timestamp", datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"))
-    existing_data.append(data)
-    with open(filename, 'w', encoding='utf-8') as file:
-        json.dump(existing_data, file, indent=4)
-
-def load_existing_tweet_data(filename="reply.json"):
-    if os.path.exists(filename):
-        with open(filename, 'r') as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError:
-                print("JSON file is empty or invalid. Starting fresh.")
-                return []
-    else:
-        return []
+    ledger.record(data)
 
-def is_tweet_responded(tweet_id, existing_data):
-    if not existing_data:
-        return False
-    for tweet in existing_data:
-        if tweet.get("tweet_id_tagging_bot") == tweet_id:
-            return True
-    return False
+def is_tweet_responded(tweet_id):
+    return ledger.has_tweet(tweet_id)
 
-def get_tweet_url(tweet_id, client):
-    tweet_data = client.get_tweet(tweet_id, tweet_fields="author_id")
-    author_id = tweet_data.data["author_id"]
-    user_data = client.get_user(id=author_id, user_fields="username")
-    username = user_data.data["username"]
-    return f"https://x.com/{username}/status/{tweet_id}"
+def get_tweet_url(tweet_id, author_id):
+    return user_cache.tweet_url(client, tweet_id, author_id)
 
-claude_client = Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+claude_client = claude_limit.wrap(Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
 
 def generate_summary(response_text, tweet_text=None):
-    new_client = Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    new_client = claude_limit.wrap(Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
     if tweet_text:
         prompt = f"Tweet context: {tweet_text}\nLea's response: {response_text}"
     else:
@@ -394,67 +259,118 @@ user_list = [
     "france24"
 ]
 
+WATCHLIST_MODE = os.getenv("WATCHLIST_MODE", "timelines")
+timeline_fanout = TimelineFanout()
+watchlist = Watchlist(user_list)
+
+def remember_includes(includes):
+    user_cache.remember_users(includes.get('users'))
+    image_analyzer.remember_includes(includes)
+
+def fetch_user_timeline(username, user_id, max_tweets, cutoff_time, since_id=None):
+    try:
+        tweets = client.get_users_tweets(
+            id=user_id,
+            max_results=max_tweets,
+            since_id=since_id,
+            start_time=None if since_id else cutoff_time,
+            tweet_fields=TWEET_FIELDS,
+            expansions=TWEET_EXPANSIONS,
+            user_fields=["username","public_metrics"],
+            media_fields=MEDIA_FIELDS,
+            exclude=["retweets","replies"]
+        )
+    except tweepy.errors.NotFound:
+        watchlist.forget(username)
+        raise
+    if tweets and tweets.errors and not tweets.data:
+        print(f"Timeline lookup failed for @{username}: {tweets.errors[0].get('detail')}")
+        watchlist.forget(username)
+        return []
+    followers = 0
+    if tweets and tweets.includes:
+        remember_includes(tweets.includes)
+        for user in tweets.includes.get('users', []):
+            if str(user.id) == str(user_id):
+                watchlist.update_username(username, user.username)
+                followers = (user.public_metrics or {}).get('followers_count', 0)
+    if not tweets or not tweets.data:
+        return []
+    return [{'tweet': tw, 'username': username, 'followers': followers} for tw in tweets.data]
+
+def ingest_tweets(fetched, cutoff_time):
+    # Returns the recent tweets and the newest id seen per account. The
+    # watermarks are only saved once the batch is classified and queued, so
+    # a cycle that fails before that fetches the same tweets again.
+    recent = []
+    seen = set()
+    watermarks = {}
+    for t in fetched:
+        tw = t['tweet']
+        if int(tw.id) > int(watermarks.get(t['username'], 0)):
+            watermarks[t['username']] = tw.id
+        if tw.id in seen:
+            continue
+        seen.add(tw.id)
+        if tw.created_at and tw.created_at > cutoff_time:
+            recent.append(t)
+    return recent, watermarks
+
+def save_watermarks(watermarks):
+    for username, tweet_id in watermarks.items():
+        watchlist.advance(username, tweet_id)
+
 def fetch_recent_tweets_from_users(usernames, max_tweets=10, minutes=5):
-    relevant_tweets = []
     cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-    for username in usernames:
-        try:
-            user = client.get_user(username=username)
-            if user and user.data:
-                user_id = user.data.id
-                tweets = client.get_users_tweets(
-                    id=user_id,
-                    max_results=max_tweets,
-                    tweet_fields=["created_at","author_id","text"],
-                    exclude=["retweets","replies"]
-                )
-                if tweets and tweets.data:
-                    for tw in tweets.data:
-                        tweet_time = tw.created_at
-                        if tweet_time and tweet_time > cutoff_time:
-                            relevant_tweets.append({'tweet': tw, 'username': username})
-        except Exception as e:
-            print(f"Error fetching tweets for {username}: {e}")
+    if WATCHLIST_MODE == "search":
+        fetched = search_watchlist(
+            client,
+            dedupe_usernames(usernames),
+            cutoff_time,
+            since_ids=watchlist.since_ids(cutoff_time),
+            on_includes=remember_includes
+        )
+    else:
+        user_ids = watchlist.resolve(client)
+        since_ids = watchlist.since_ids(cutoff_time)
+        usernames = [username for username in dedupe_usernames(usernames) if username in user_ids]
+        timelines = timeline_fanout.run(usernames, lambda username: fetch_user_timeline(username, user_ids[username], max_tweets, cutoff_time, since_ids.get(username)), raise_errors=(tweepy.errors.TooManyRequests,))
+        fetched = []
+        for username in usernames:
+            fetched.extend(timelines.get(username, []))
+    relevant_tweets, watermarks = ingest_tweets(fetched, cutoff_time)
     print("Tweets pertinents récupérés:")
     for t in relevant_tweets:
         print(f"- {t['tweet'].text} (by @{t['username']})")
-    return relevant_tweets
-
-def is_relevant_tweet(tweet_text):
-    check_prompt = (
-        "Please carefully analyze the following tweet and determine if there's actual text to respond to. If it's just a link or not relevant, say no. If we can say something, we say yes.\n"
-        f"Tweet: {tweet_text}"
-    )
-    result = claude_client.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=10,
-        messages=[{"role": "user", "content": check_prompt}]
-    )
-    return "yes" in result.content[0].text.strip().lower()
-
-def pick_tweet_to_respond(tweets):
-    if not tweets:
-        return None
-    return random.choice(tweets)
-
-def can_respond_to_user(username, existing_data, max_per_hour=2):
-    current_time = datetime.now(timezone.utc)
-    cutoff_time = current_time - timedelta(hours=1)
-    count = 0
-    for entry in existing_data:
-        if entry.get('username') == username:
-            timestamp_str = entry.get('timestamp')
-            if timestamp_str:
-                try:
-                    timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
-                    timestamp = timestamp.replace(tzinfo=timezone.utc)
-                    if timestamp > cutoff_time:
-                        count += 1
-                        if count >= max_per_hour:
-                            return False
-                except ValueError:
-                    print(f"Invalid timestamp format: {timestamp_str}")
-    return count < max_per_hour
+    return relevant_tweets, watermarks
+
+RELEVANCE_POLICY = os.getenv("RELEVANCE_POLICY", "respondable")
+relevance_classifier = RelevanceClassifier(claude_client, POLICIES[RELEVANCE_POLICY])
+prefilter = Prefilter.load(RELEVANCE_POLICY)
+
+def is_relevant_tweet(tweet_text, tweet_id=None):
+    return relevance_classifier.classify_one(tweet_text, tweet_id)
+
+def filter_relevant_tweets(tweets):
+    verdicts = {}
+    ambiguous = []
+    for tw in tweets:
+        verdict = prefilter.decide(tw['tweet'].text)
+        if verdict is None or prefilter.should_audit():
+            ambiguous.append((str(tw['tweet'].id), tw['tweet'].text))
+        else:
+            verdicts[str(tw['tweet'].id)] = verdict
+    print(f"Pre-filter decided {len(verdicts)}/{len(tweets)} tweets, {len(ambiguous)} sent to Claude.")
+    if ambiguous:
+        llm_verdicts = relevance_classifier.classify(ambiguous)
+        for tweet_id, text in ambiguous:
+            ledger.record_label(tweet_id, RELEVANCE_POLICY, text, llm_verdicts[tweet_id])
+        verdicts.update(llm_verdicts)
+    return [tw for tw in tweets if verdicts.get(str(tw['tweet'].id))]
+
+def can_respond_to_user(username, max_per_hour=2):
+    cutoff_time = datetime.now(timezone.utc) - timedelta(hours=1)
+    return ledger.count_responses(username, cutoff_time) < max_per_hour
 
 SUBTITLES_API_KEY = os.environ["SUBTITLES_API_KEY"]
 TEMPLATE_ID = os.environ["SUBTITLES_TEMPLATE_ID"]
@@ -488,7 +404,8 @@ Rules:
         "max_tokens": 4096
     }
     try:
-        response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
+        with claude_limit:
+            response = http.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
         if response.status_code != 200:
             print("Claude API error:", response.text)
             return None
@@ -513,7 +430,7 @@ def upload_video(file_path, api_key):
     headers = {"X-Api-Key": api_key}
     with open(file_path, 'rb') as file:
         files = {'file': file}
-        response = requests.post(url, headers=headers, files=files)
+        response = http.post(url, headers=headers, files=files)
     if response.status_code != 201:
         print("Error uploading:", response.text)
         return None
@@ -525,7 +442,7 @@ def create_transcription_task(video_id, template_id, language='en'):
     url = f"https://api.subtitles.ai/videos/{video_id}/task"
     headers = {"Content-Type": "application/json", "X-Api-Key": SUBTITLES_API_KEY}
     payload = {"templateId": template_id, "language": language, "autoApprove": True}
-    response = requests.post(url, json=payload, headers=headers)
+    response = http.post(url, json=payload, headers=headers)
     if response.status_code != 201:
         print("Error creating task:", response.text)
         return None
@@ -539,7 +456,7 @@ def check_task_status(video_id, task_id):
     retry_count = 0
     max_retries = 30
     while retry_count < max_retries:
-        response = requests.get(url, headers=headers)
+        response = http.get(url, headers=headers)
         if response.status_code != 200:
             print("Error checking status:", response.text)
             return None, None
@@ -557,7 +474,7 @@ def check_task_status(video_id, task_id):
 def get_transcript(video_id, task_id):
     url = f"https://api.subtitles.ai/videos/{video_id}/task/{task_id}/transcript"
     headers = {"X-Api-Key": SUBTITLES_API_KEY}
-    response = requests.get(url, headers=headers)
+    response = http.get(url, headers=headers)
     if response.status_code != 200:
         print("Error getting transcript:", response.text)
         return None
@@ -572,7 +489,7 @@ def create_subtitle_task(video_id, transcript):
         "autoApprove": True,
         "language": LANGUAGE
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = http.post(url, headers=headers, json=payload)
     if response.status_code != 201:
         print("Error creating subtitle task:", response.text)
         return None
@@ -580,147 +497,207 @@ def create_subtitle_task(video_id, transcript):
     print(f"Subtitle task created. ID: {task_id}")
     return task_id
 
-def process_chosen_tweet(chosen_tweet_dict):
-    tweet = chosen_tweet_dict['tweet']
-    username = chosen_tweet_dict['username']
+pending_tweet_ids = set()
+pending_user_counts = {}
+pending_lock = threading.Lock()
+
+def claim_tweet(tweet_id, username, max_per_hour=2):
+    with pending_lock:
+        if tweet_id in pending_tweet_ids:
+            print(f"Tweet {tweet_id} is already being processed. Skipping")
+            return False
+        if is_tweet_responded(tweet_id):
+            print(f"Already answered tweet {tweet_id}. Skipping")
+            return False
+        if not can_respond_to_user(username, max_per_hour - pending_user_counts.get(username, 0)):
+            print(f"User @{username} has reached the response limit in the past hour. Skipping tweet {tweet_id}.")
+            return False
+        pending_tweet_ids.add(tweet_id)
+        pending_user_counts[username] = pending_user_counts.get(username, 0) + 1
+        return True
+
+def has_response_budget(username, max_per_hour=2):
+    with pending_lock:
+        return can_respond_to_user(username, max_per_hour - pending_user_counts.get(username, 0))
+
+def release_tweet(tweet_id, username):
+    with pending_lock:
+        pending_tweet_ids.discard(tweet_id)
+        pending_user_counts[username] = pending_user_counts.get(username, 1) - 1
+        if pending_user_counts[username] <= 0:
+            del pending_user_counts[username]
+
+def download_video(video_url, local_video_path):
+    with http.get(video_url, stream=True) as r:
+        r.raise_for_status()
+        with open(local_video_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    return local_video_path
+
+def add_subtitles(local_video_path, response_text):
+    video_id = upload_video(local_video_path, SUBTITLES_API_KEY)
+    if not video_id:
+        raise Exception("Failed to upload to subtitles")
+    transcription_task_id = create_transcription_task(video_id, TEMPLATE_ID)
+    if not transcription_task_id:
+        raise Exception("Failed to create transcription task")
+    status, _ = check_task_status(video_id, transcription_task_id)
+    if not status:
+        raise Exception("Transcription task failed")
+    original_transcript = get_transcript(video_id, transcription_task_id)
+    if not original_transcript:
+        raise Exception("Failed to get transcript")
+    corrected_transcript = correct_transcript_with_claude(original_transcript, response_text)
+    if not corrected_transcript:
+        raise Exception("Failed to correct transcript")
+    subtitle_task_id = create_subtitle_task(video_id, corrected_transcript)
+    if not subtitle_task_id:
+        raise Exception("Failed to create subtitle task")
+    status, final_video_url = check_task_status(video_id, subtitle_task_id)
+    if not status or not final_video_url:
+        raise Exception("Failed to get final video URL")
+    return final_video_url
+
+# A chosen tweet moves through these stages as a job dict, each stage with its
+# own workers, so the next tweet can be in TTS while one waits on Movement.
+def prepare_stage(job):
+    tweet = job['tweet']
     tweet_id = tweet.id
-    tweet_text = tweet.text
-    existing_data = load_existing_tweet_data()
-    if not can_respond_to_user(username, existing_data):
-        print(f"User @{username} has reached the response limit in the past hour. Skipping tweet {tweet_id}.")
-        return
-    if is_tweet_responded(str(tweet_id), existing_data):
-        print(f"Already answered tweet {tweet_id}. Skipping")
-        return
-    current_tweet_url = get_tweet_url(tweet_id, client)
-    image_analysis = image_analyzer.process_tweet_image(current_tweet_url)
-    if not image_analysis:
-        tweet_details = client.get_tweet(tweet_id, expansions='referenced_tweets.id', tweet_fields=['author_id','created_at','referenced_tweets'])
-        if tweet_details and tweet_details.includes and 'tweets' in tweet_details.includes:
-            main_referenced = tweet_details.data.get('referenced_tweets', [])
-            quoted_id = None
-            for ref in main_referenced:
-                if ref['type'] == 'quoted':
-                    quoted_id = ref['id']
-                    break
-            if quoted_id:
-                quoted_tweet_url = get_tweet_url(quoted_id, client)
-                image_analysis = image_analyzer.process_tweet_image(quoted_tweet_url)
-    context = tweet_text
+    print(f"Tweet URL: {get_tweet_url(tweet_id, tweet.author_id)}")
+    image_analysis = image_analyzer.process_hydrated_tweet(tweet, referenced_types=("quoted",))
+    context = tweet.text
     if image_analysis:
         context += "\nImage context: " + image_analysis
-    response_text = generate_text_with_claude(context, image_analysis if image_analysis else None)
-    summary_text = generate_summary(response_text, tweet_text)
-    print(summary_text)
-    audio_url = generate_audio_with_eleven_labs(response_text, voice_id, elevenlabs_api_key)
-    if audio_url:
-        avatar_creator = AIAvatarCreator(movement_api_key)
-        project_id = avatar_creator.create_avatar(photo_url, audio_url, box_coordinates)
-        if project_id:
-            video_url = avatar_creator.get_video_url(project_id)
-            if video_url:
-                local_video_path = "video_response.mp4"
-                with requests.get(video_url, stream=True) as r:
-                    r.raise_for_status()
-                    with open(local_video_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                try:
-                    video_id = upload_video(local_video_path, SUBTITLES_API_KEY)
-                    if not video_id:
-                        raise Exception("Failed to upload to subtitles")
-                    transcription_task_id = create_transcription_task(video_id, TEMPLATE_ID)
-                    if not transcription_task_id:
-                        raise Exception("Failed to create transcription task")
-                    status, _ = check_task_status(video_id, transcription_task_id)
-                    if not status:
-                        raise Exception("Transcription task failed")
-                    original_transcript = get_transcript(video_id, transcription_task_id)
-                    if not original_transcript:
-                        raise Exception("Failed to get transcript")
-                    corrected_transcript = correct_transcript_with_claude(original_transcript, response_text)
-                    if not corrected_transcript:
-                        raise Exception("Failed to correct transcript")
-                    subtitle_task_id = create_subtitle_task(video_id, corrected_transcript)
-                    if not subtitle_task_id:
-                        raise Exception("Failed to create subtitle task")
-                    status, final_video_url = check_task_status(video_id, subtitle_task_id)
-                    if not status or not final_video_url:
-                        raise Exception("Failed to get final video URL")
-                    subtitled_video_path = "video_response_subtitled.mp4"
-                    with requests.get(final_video_url, stream=True) as r:
-                        r.raise_for_status()
-                        with open(subtitled_video_path, 'wb') as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                    tweet_id_video = upload_and_post_video_v2(subtitled_video_path, tweet_id, summary_text)
-                    tweet_data = {
-                        "username": username,
-                        "tweet_text_received": tweet_text,
-                        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                        "bot_response": response_text,
-                        "tweet_id_video_posted": tweet_id_video,
-                        "tweet_id_tagging_bot": str(tweet_id)
-                    }
-                    save_tweet_data_to_json(tweet_data)
-                    os.remove(local_video_path)
-                    os.remove(subtitled_video_path)
-                except Exception as e:
-                    print(f"Error in subtitle process: {e}")
-            else:
-                print("Failed to retrieve video URL.")
-        else:
-            print("Failed to create avatar.")
-    else:
+    job['context'] = context
+    job['image_analysis'] = image_analysis
+    return job
+
+def llm_stage(job):
+    job['response_text'] = generate_text_with_claude(job['context'], job['image_analysis'] if job['image_analysis'] else None)
+    job['summary_text'] = generate_summary(job['response_text'], job['tweet'].text)
+    print(job['summary_text'])
+    return job
+
+def tts_stage(job):
+    audio_url = generate_audio_with_eleven_labs(job['response_text'], voice_id, elevenlabs_api_key, f"audio_output_{job['tweet'].id}.mp3")
+    if not audio_url:
         print("Failed to synthesize audio.")
+        return None
+    job['audio_url'] = audio_url
+    return job
+
+def avatar_stage(job):
+    avatar_creator = AIAvatarCreator(movement_api_key)
+    project_id = avatar_creator.create_avatar(photo_url, job['audio_url'], box_coordinates)
+    if not project_id:
+        print("Failed to create avatar.")
+        return None
+    video_url = avatar_creator.get_video_url(project_id)
+    if not video_url:
+        print("Failed to retrieve video URL.")
+        return None
+    job['local_video_path'] = download_video(video_url, f"video_response_{job['tweet'].id}.mp4")
+    return job
 
-MAX_RESPONSES_PER_CYCLE = 5
-DELAY_BETWEEN_RESPONSES = 2
+def subtitles_stage(job):
+    try:
+        final_video_url = add_subtitles(job['local_video_path'], job['response_text'])
+        job['subtitled_video_path'] = download_video(final_video_url, f"video_response_subtitled_{job['tweet'].id}.mp4")
+    except Exception as e:
+        print(f"Error in subtitle process: {e}")
+        return None
+    return job
+
+def post_stage(job):
+    tweet = job['tweet']
+    tweet_id_video = upload_and_post_video_v2(job['subtitled_video_path'], tweet.id, job['summary_text'])
+    tweet_data = {
+        "username": job['username'],
+        "tweet_text_received": tweet.text,
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "bot_response": job['response_text'],
+        "tweet_id_video_posted": tweet_id_video,
+        "tweet_id_tagging_bot": str(tweet.id)
+    }
+    save_tweet_data(tweet_data)
+    cooldowns.record(job['username'])
+    return job
+
+def finish_job(job):
+    for key in ('local_video_path', 'subtitled_video_path'):
+        if job.get(key) and os.path.exists(job[key]):
+            os.remove(job[key])
+    http.log_stats()
+    release_tweet(job['tweet'].id, job['username'])
+
+response_pipeline = Pipeline([
+    Stage("prepare", prepare_stage, stage_workers("MAX_CONCURRENT_TWEETS", 2)),
+    Stage("claude", llm_stage, stage_workers("CLAUDE_MAX_CONCURRENCY", 4)),
+    Stage("elevenlabs", tts_stage, stage_workers("ELEVEN_LABS_MAX_CONCURRENCY", 2)),
+    Stage("movement", avatar_stage, stage_workers("MOVEMENT_MAX_CONCURRENCY", 2)),
+    Stage("subtitles", subtitles_stage, stage_workers("SUBTITLES_MAX_CONCURRENCY", 2)),
+    Stage("post", post_stage, stage_workers("POST_MAX_CONCURRENCY", 1))
+], on_done=finish_job).start()
+
+def process_chosen_tweet(chosen_tweet_dict):
+    tweet = chosen_tweet_dict['tweet']
+    username = chosen_tweet_dict['username']
+    if not claim_tweet(tweet.id, username):
+        return False
+    response_pipeline.submit({'tweet': tweet, 'username': username})
+    return True
+
+POLL_INTERVAL = 100
+# Minimum spacing between two queued replies, whoever they are for.
+REPLY_MIN_INTERVAL = int(os.getenv("REPLY_MIN_INTERVAL", "900"))
+
+candidate_scheduler = CandidateScheduler()
+cooldowns = CooldownTracker.from_ledger(ledger)
+next_poll = 0
+next_reply = 0
+
+def is_eligible(candidate):
+    # Cooldowns are recorded once a reply is posted, so a user with a reply
+    # still in the pipeline waits for it.
+    username = candidate['username']
+    with pending_lock:
+        if pending_user_counts.get(username, 0):
+            return False
+    return cooldowns.is_eligible(username) and has_response_budget(username)
 
 while True:
     try:
-        print("Checking recent tweets from predefined user list...")
-        tweets = fetch_recent_tweets_from_users(user_list, max_tweets=10, minutes=10)
-        relevant_tweets = [tw for tw in tweets if is_relevant_tweet(tw['tweet'].text)]
-        if relevant_tweets:
-            print(f"Found {len(relevant_tweets)} relevant tweet(s).")
-            for i, tweet_dict in enumerate(relevant_tweets):
-                chosen_tweet = pick_tweet_to_respond(relevant_tweets)
-                if chosen_tweet:
-                    current_username = chosen_tweet['username']
-                    tweet = chosen_tweet['tweet']
-                    print(f"Selected tweet to respond: @{current_username}: {tweet.text}")
-                    existing_data = load_existing_tweet_data()
-                    last_response_time = None
-                    for entry in existing_data:
-                        if entry.get('username') == current_username:
-                            last_response_time = datetime.strptime(entry['timestamp'], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-                            break
-                    if last_response_time:
-                        time_since_last_response = datetime.now(timezone.utc) - last_response_time
-                        if time_since_last_response < timedelta(minutes=15):
-                            print(f"Skipping @{current_username}, responded in last 15 minutes.")
-                            time.sleep(900)
-                            continue
-                    responses_today = sum(
-                        1 for entry in existing_data 
-                        if entry.get('username') == current_username and 
-                        datetime.strptime(entry['timestamp'], "%Y-%m-%d %H:%M:%S").date() == datetime.now(timezone.utc).date()
-                    )
-                    if responses_today >= 2:
-                        print(f"Skipping @{current_username}, responded 2 times today.")
-                        time.sleep(900)
-                    else:
-                        process_chosen_tweet(chosen_tweet)
-                        print("Response sent. Waiting 15 minutes before processing again...")
-                        time.sleep(900)
-                else:
-                    print("No relevant tweets found.")
-                    time.sleep(900)
-        else:
-            print("No relevant tweets found.")
-        print("Waiting 300 seconds (5 minutes) before checking again...")
-        time.sleep(100)
+        if time.time() >= next_poll:
+            print("Checking recent tweets from predefined user list...")
+            tweets, watermarks = fetch_recent_tweets_from_users(user_list, max_tweets=10, minutes=10)
+            relevant_tweets = filter_relevant_tweets(tweets)
+            if relevant_tweets:
+                print(f"Found {len(relevant_tweets)} relevant tweet(s).")
+                candidate_scheduler.add(relevant_tweets)
+            else:
+                print("No relevant tweets found.")
+            save_watermarks(watermarks)
+            next_poll = time.time() + POLL_INTERVAL
+        chosen_tweet = candidate_scheduler.pop(is_eligible) if time.time() >= next_reply else None
+        if chosen_tweet:
+            current_username = chosen_tweet['username']
+            print(f"Selected tweet to respond: @{current_username}: {chosen_tweet['tweet'].text}")
+            if process_chosen_tweet(chosen_tweet):
+                next_reply = time.time() + REPLY_MIN_INTERVAL
+                print(f"Response queued for @{current_username}.")
+            continue
+        wake_at = next_poll
+        if len(candidate_scheduler):
+            if time.time() < next_reply:
+                wake_at = min(wake_at, next_reply)
+            else:
+                eligible_at = cooldowns.earliest_eligible()
+                if eligible_at is not None:
+                    wake_at = min(wake_at, eligible_at)
+        delay = max(wake_at - time.time(), 1)
+        print(f"{len(candidate_scheduler)} candidate(s) waiting on the reply interval or cooldowns. Sleeping {delay:.0f} seconds...")
+        time.sleep(delay)
     except TooManyRequests as e:
         print("Rate limit exceeded. Waiting for reset...")
         if hasattr(e, 'retry_after'):
@@ -0,0 +1,180 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+RELEVANCE_MODEL = "claude-3-5-sonnet-20241022"
+RELEVANCE_BATCH_SIZE = int(os.getenv("RELEVANCE_BATCH_SIZE", "20"))
+RELEVANCE_MAX_WORKERS = int(os.getenv("RELEVANCE_MAX_WORKERS", "3"))
+RELEVANCE_CACHE_TTL = int(os.getenv("RELEVANCE_CACHE_TTL", "86400"))
+RELEVANCE_CACHE_MAX_ENTRIES = int(os.getenv("RELEVANCE_CACHE_MAX_ENTRIES", "20000"))
+RELEVANCE_CACHE_PATH = os.getenv("RELEVANCE_CACHE_PATH", "")
+
+class RelevancePolicy:
+    def __init__(self, name, version, prompt, separator):
+        self.name = name
+        self.version = version
+        self.prompt = prompt
+        self.separator = separator
+
+    def cache_key(self, tweet_id):
+        return f"{self.name}:{self.version}:{tweet_id}"
+
+    def single_prompt(self, tweet_text):
+        return f"{self.prompt}{self.separator}Tweet: {tweet_text}"
+
+    def batch_prompt(self, items):
+        return (
+            f"{self.prompt}\n\n"
+            "Apply this to each tweet below independently. Return ONLY a JSON array with one entry per tweet, "
+            'like [{"id": "123", "relevant": "yes"}], using "yes" or "no".\n\n'
+            f"Tweets:\n{json.dumps(items, ensure_ascii=False)}"
+        )
+
+POLICIES = {
+    "topics": RelevancePolicy(
+        "topics",
+        1,
+        "Please carefully analyze the following tweet and determine whether it is related to any of the following domains: (1) cryptocurrency or blockchain technology (including memecoins, tokens like DOGE, BTC, ..., shitcoins, solana, bitcoin, any blockchain or any type of crypto token), (2) political figures or issues specifically involving well-known leaders such as Trump, Putin, Zelensky, or Macron, or (3) artificial intelligence, including AI agents, machine learning models, or other AI-related topics.",
+        "\n\n"
+    ),
+    "respondable": RelevancePolicy(
+        "respondable",
+        1,
+        "Please carefully analyze the following tweet and determine if there's actual text to respond to. If it's just a link or not relevant, say no. If we can say something, we say yes.",
+        "\n"
+    ),
+}
+
+VERDICT_PATTERN = re.compile(r'"id"\s*:\s*"?(\d+)"?[^{}]*?"relevant"\s*:\s*"?(yes|no|true|false)', re.IGNORECASE)
+
+def is_yes(value):
+    return str(value).strip().lower() in ("yes", "true")
+
+def parse_verdicts(text):
+    verdicts = {}
+    start = text.find('[')
+    end = text.rfind(']')
+    if start != -1 and end > start:
+        try:
+            for entry in json.loads(text[start:end + 1]):
+                if isinstance(entry, dict) and 'id' in entry and 'relevant' in entry:
+                    verdicts[str(entry['id'])] = is_yes(entry['relevant'])
+            return verdicts
+        except ValueError:
+            pass
+    # Truncated or chatty answers: keep whatever entries can still be read.
+    for tweet_id, relevant in VERDICT_PATTERN.findall(text):
+        verdicts[tweet_id] = is_yes(relevant)
+    return verdicts
+
+class VerdictCache:
+    def __init__(self, ttl=RELEVANCE_CACHE_TTL, max_entries=RELEVANCE_CACHE_MAX_ENTRIES, path=RELEVANCE_CACHE_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, relevant INTEGER NOT NULL, stored_at REAL NOT NULL)")
+            self.conn.execute("DELETE FROM verdicts WHERE stored_at < ?", (time.time() - ttl,))
+            self.conn.commit()
+            rows = self.conn.execute(
+                "SELECT key, relevant, stored_at FROM verdicts ORDER BY stored_at DESC LIMIT ?",
+                (max_entries,)
+            ).fetchall()
+            for key, relevant, stored_at in reversed(rows):
+                self.entries[key] = (bool(relevant), stored_at)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, relevant):
+        now = time.time()
+        with self.lock:
+            self.entries[key] = (relevant, now)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO verdicts (key, relevant, stored_at) VALUES (?, ?, ?)", (key, int(relevant), now))
+                self.conn.execute("DELETE FROM verdicts WHERE stored_at < ?", (now - self.ttl,))
+                self.conn.commit()
+
+    def describe(self):
+        with self.lock:
+            return f"{self.hits} hits, {self.misses} misses, {len(self.entries)} cached"
+
+class RelevanceClassifier:
+    def __init__(self, claude_client, policy, batch_size=RELEVANCE_BATCH_SIZE, max_workers=RELEVANCE_MAX_WORKERS, cache=None):
+        self.claude_client = claude_client
+        self.policy = policy
+        self.batch_size = batch_size
+        self.cache = cache or VerdictCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="relevance")
+
+    def classify_one(self, tweet_text, tweet_id=None):
+        if tweet_id is not None:
+            cached = self.cache.get(self.policy.cache_key(tweet_id))
+            if cached is not None:
+                return cached
+        response = self.claude_client.messages.create(
+            model=RELEVANCE_MODEL,
+            max_tokens=10,
+            messages=[{"role": "user", "content": self.policy.single_prompt(tweet_text)}]
+        )
+        relevant = "yes" in response.content[0].text.strip().lower()
+        if tweet_id is not None:
+            self.cache.put(self.policy.cache_key(tweet_id), relevant)
+        return relevant
+
+    def _classify_batch(self, batch):
+        # API errors (rate limits, overload) propagate so the caller backs
+        # off; only tweets the answer did not cover are retried one by one.
+        items = [{"id": tweet_id, "text": text} for tweet_id, text in batch]
+        response = self.claude_client.messages.create(
+            model=RELEVANCE_MODEL,
+            max_tokens=50 + 20 * len(batch),
+            messages=[{"role": "user", "content": self.policy.batch_prompt(items)}]
+        )
+        verdicts = {tweet_id: relevant for tweet_id, relevant in parse_verdicts(response.content[0].text).items() if tweet_id in dict(batch)}
+        for tweet_id, relevant in verdicts.items():
+            self.cache.put(self.policy.cache_key(tweet_id), relevant)
+        missing = [(tweet_id, text) for tweet_id, text in batch if tweet_id not in verdicts]
+        if missing:
+            print(f"No verdict for {len(missing)}/{len(batch)} tweets in the batch, checking them one by one.")
+        for tweet_id, text in missing:
+            verdicts[tweet_id] = self.classify_one(text, tweet_id)
+        return {tweet_id: verdicts[tweet_id] for tweet_id, _ in batch}
+
+    def classify(self, tweets):
+        verdicts = {}
+        uncached = []
+        for tweet_id, text in tweets:
+            cached = self.cache.get(self.policy.cache_key(tweet_id))
+            if cached is None:
+                uncached.append((str(tweet_id), text))
+            else:
+                verdicts[str(tweet_id)] = cached
+        batches = [uncached[i:i + self.batch_size] for i in range(0, len(uncached), self.batch_size)]
+        for result in self.executor.map(self._classify_batch, batches):
+            verdicts.update(result)
+        print(f"Relevance cache: {self.cache.describe()}")
+        return verdicts
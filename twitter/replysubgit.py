@@ -1,102 +1,29 @@
-import requests
 import anthropic
 import tweepy
 from requests_oauthlib import OAuth1
 import time
 import os
+import sys
 from datetime import datetime, timedelta
-import random
-import json
 import re
-import base64
 import cloudinary
 import cloudinary.uploader
 from anthropic import Anthropic
-
-class TwitterImageAnalyzer:
-    def __init__(self, bearer_token, claude_api_key):
-        self.twitter_client = tweepy.Client(bearer_token=bearer_token)
-        self.claude_client = anthropic.Anthropic(api_key=claude_api_key)
-
-    def check_tweet_media(self, tweet_url):
-        try:
-            tweet_id = tweet_url.split('/')[-1]
-            tweet = self.twitter_client.get_tweet(
-                id=tweet_id,
-                expansions=['attachments.media_keys'],
-                media_fields=['url', 'type']
-            )
-            if tweet.includes and 'media' in tweet.includes:
-                image_urls = [
-                    media.url for media in tweet.includes['media']
-                    if media.type == 'photo'
-                ]
-                return image_urls if image_urls else None
-        except Exception as e:
-            print(f"Error checking media: {e}")
-        return None
-
-    def download_image(self, image_url):
-        try:
-            response = requests.get(image_url)
-            response.raise_for_status()
-            return response.content
-        except Exception as e:
-            print(f"Error downloading the image: {e}")
-            return None
-
-    def encode_image_base64(self, image_content):
-        return base64.b64encode(image_content).decode('utf-8')
-
-    def analyze_images_with_claude(self, image_base64_list):
-        analyses = []
-        for image_base64 in image_base64_list:
-            try:
-                response = self.claude_client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1000,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/jpeg",
-                                        "data": image_base64
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "Describe precisely what you see in this image. Be detailed and objective. And give your opinion. If there are numbers associated to some token or nft, regroup the together and describe everything. If it's a chart, check if there is a big red candle at the end, means it's a rug or scam but if there is a big green candle, it's pumping so it's bullish so always say if it's a bullish chart, bearish or neutral. If it's not a chart, don't talk about chart. Always describe everything with precision"
-                                }
-                            ]
-                        }
-                    ]
-                )
-                analyses.append(response.content[0].text)
-            except Exception as e:
-                print(f"Error analyzing an image: {e}")
-                analyses.append("Unable to analyze this image")
-        return analyses
-
-    def process_tweet_image(self, tweet_url):
-        image_urls = self.check_tweet_media(tweet_url)
-        if not image_urls:
-            return None
-        image_base64_list = []
-        for image_url in image_urls:
-            image_content = self.download_image(image_url)
-            if image_content:
-                image_base64_list.append(self.encode_image_base64(image_content))
-        if not image_base64_list:
-            return None
-        analyses = self.analyze_images_with_claude(image_base64_list)
-        if len(analyses) == 1:
-            return analyses[0]
-        else:
-            return "\n\n".join([f"Image {i+1} :\n{analyse}" for i, analyse in enumerate(analyses)])
+import threading
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from thread_cache import ConversationCache
+from image_analyzer import TwitterImageAnalyzer
+from user_cache import UsernameCache
+from ledger import ResponseLedger
+from tweet_lookup import get_tweet_authors
+from mention_source import PollingMentionSource, StreamingMentionSource
+from poll_scheduler import PollScheduler
+from common.persona import PersonaStore
+from common.transport import http
+from common.prompt_cache import cached_system, prompt_cache_stats, warn_if_uncacheable
+from common.pipeline import Pipeline, Stage, claude_limit, stage_workers
+
+MAX_PENDING_MENTIONS = int(os.getenv("MAX_PENDING_MENTIONS", "50"))
 
 api_key = os.environ["TWITTER_API_KEY"]
 api_secret = os.environ["TWITTER_API_SECRET"]
@@ -107,6 +34,7 @@ access_token_secret = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
 client = tweepy.Client(bearer_token, api_key, api_secret, access_token, access_token_secret)
 auth = tweepy.OAuth1UserHandler(api_key, api_secret, access_token, access_token_secret)
 api = tweepy.API(auth)
+user_cache = UsernameCache()
 
 movement_api_key = os.environ["MOVEMENT_API_KEY"]
 photo_url = "https://s11.gifyu.com/images/SyFer.png"
@@ -118,17 +46,31 @@ outline_colour = "&H00da77da"
 def create_auth():
     return OAuth1(api_key, api_secret, access_token, access_token_secret)
 
+MENTION_QUERY = '@lea_gpt -is:retweet'
+poll_scheduler = PollScheduler()
+MENTION_FIELDS = {
+    'tweet.fields': 'author_id,conversation_id,referenced_tweets,created_at,in_reply_to_user_id,attachments',
+    'expansions': 'author_id,attachments.media_keys,referenced_tweets.id,referenced_tweets.id.attachments.media_keys',
+    'user.fields': 'username',
+    'media.fields': 'url,type'
+}
+
+def remember_includes(includes):
+    user_cache.remember_users(includes.get('users'))
+    image_analyzer.remember_includes(includes)
+
 def search_tweets(query, since_id=None, include_replies=True):
     print("Searching for tweets containing:", query)
     url = "https://api.twitter.com/2/tweets/search/recent"
     tw_auth = create_auth()
     params = {
-        'query': '@lea_gpt -is:retweet',
+        'query': MENTION_QUERY,
         'max_results': 100,
         'since_id': since_id,
-        'tweet.fields': 'author_id,conversation_id,referenced_tweets,created_at,in_reply_to_user_id'
+        **MENTION_FIELDS
     }
-    response = requests.get(url, auth=tw_auth, params=params)
+    response = http.get(url, auth=tw_auth, params=params)
+    poll_scheduler.observe(response)
     if response.status_code != 200:
         print(f"Request returned an error: {response.status_code} {response.text}")
         return None
@@ -143,6 +85,7 @@ def search_tweets(query, since_id=None, include_replies=True):
     if 'data' not in tweets:
         print("No tweets found or unexpected response format.")
         return None
+    remember_includes(tweets.get('includes', {}))
     return tweets['data']
 
 def filter_recent_engaging_tweets(tweets, time_window_minutes=10, fallback_time_window_minutes=60):
@@ -160,75 +103,30 @@ def filter_recent_engaging_tweets(tweets, time_window_minutes=10, fallback_time_
                 recent_tweets.append(tweet)
     return recent_tweets
 
-claude_client = anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+claude_client = claude_limit.wrap(anthropic.Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
 image_analyzer = TwitterImageAnalyzer(bearer_token=bearer_token, claude_api_key=os.environ["ANTHROPIC_API_KEY"])
 
+persona_store = PersonaStore(48).reload_on_sighup()
+warn_if_uncacheable(persona_store.get())
+
 def generate_text_with_claude(prompt, image_description=None):
-    character_context = (
-        os.environ["CHARACTER_CONTEXT_LINE_1"] +
-        os.environ["CHARACTER_CONTEXT_LINE_2"] +
-        os.environ["CHARACTER_CONTEXT_LINE_3"] +
-        os.environ["CHARACTER_CONTEXT_LINE_4"] +
-        os.environ["CHARACTER_CONTEXT_LINE_5"] +
-        os.environ["CHARACTER_CONTEXT_LINE_6"] +
-        os.environ["CHARACTER_CONTEXT_LINE_7"] +
-        os.environ["CHARACTER_CONTEXT_LINE_8"] +
-        os.environ["CHARACTER_CONTEXT_LINE_9"] +
-        os.environ["CHARACTER_CONTEXT_LINE_10"] +
-        os.environ["CHARACTER_CONTEXT_LINE_11"] +
-        os.environ["CHARACTER_CONTEXT_LINE_12"] +
-        os.environ["CHARACTER_CONTEXT_LINE_13"] +
-        os.environ["CHARACTER_CONTEXT_LINE_14"] +
-        os.environ["CHARACTER_CONTEXT_LINE_15"] +
-        os.environ["CHARACTER_CONTEXT_LINE_16"] +
-        os.environ["CHARACTER_CONTEXT_LINE_17"] +
-        os.environ["CHARACTER_CONTEXT_LINE_18"] +
-        os.environ["CHARACTER_CONTEXT_LINE_19"] +
-        os.environ["CHARACTER_CONTEXT_LINE_20"] +
-        os.environ["CHARACTER_CONTEXT_LINE_21"] +
-        os.environ["CHARACTER_CONTEXT_LINE_22"] +
-        os.environ["CHARACTER_CONTEXT_LINE_23"] +
-        os.environ["CHARACTER_CONTEXT_LINE_24"] +
-        os.environ["CHARACTER_CONTEXT_LINE_25"] +
-        os.environ["CHARACTER_CONTEXT_LINE_26"] +
-        os.environ["CHARACTER_CONTEXT_LINE_27"] +
-        os.environ["CHARACTER_CONTEXT_LINE_28"] +
-        os.environ["CHARACTER_CONTEXT_LINE_29"] +
-        os.environ["CHARACTER_CONTEXT_LINE_30"] +
-        os.environ["CHARACTER_CONTEXT_LINE_31"] +
-        os.environ["CHARACTER_CONTEXT_LINE_32"] +
-        os.environ["CHARACTER_CONTEXT_LINE_33"] +
-        os.environ["CHARACTER_CONTEXT_LINE_34"] +
-        os.environ["CHARACTER_CONTEXT_LINE_35"] +
-        os.environ["CHARACTER_CONTEXT_LINE_36"] +
-        os.environ["CHARACTER_CONTEXT_LINE_37"] +
-        os.environ["CHARACTER_CONTEXT_LINE_38"] +
-        os.environ["CHARACTER_CONTEXT_LINE_39"] +
-        os.environ["CHARACTER_CONTEXT_LINE_40"] +
-        os.environ["CHARACTER_CONTEXT_LINE_41"] +
-        os.environ["CHARACTER_CONTEXT_LINE_42"] +
-        os.environ["CHARACTER_CONTEXT_LINE_43"] +
-        os.environ["CHARACTER_CONTEXT_LINE_44"] +
-        os.environ["CHARACTER_CONTEXT_LINE_45"] +
-        os.environ["CHARACTER_CONTEXT_LINE_46"] +
-        os.environ["CHARACTER_CONTEXT_LINE_47"] +
-        os.environ["CHARACTER_CONTEXT_LINE_48"]
-    )
     if image_description:
         full_prompt = (
-            f"{character_context}\n\n{prompt}\n\n"
+            f"{prompt}\n\n"
             f"Note: A detailed analysis of the image is available. Use this analysis if relevant and when asked or to support your answer, provide image elements. If someone asks to explain or describe the picture, do it with some precision. Only if needed use the image analysis else don't use it.\n\n"
             f"Image analysis:\n{image_description}"
         )
     else:
-        full_prompt = f"{character_context}\n{prompt}"
+        full_prompt = prompt
     response = claude_client.messages.create(
         model="claude-3-5-sonnet-20241022",
         max_tokens=500,
+        system=cached_system(persona_store.get()),
         messages=[
             {"role": "user", "content": full_prompt}
         ]
     )
+    prompt_cache_stats.record(response)
     generated_text = response.content[0].text
     print(generated_text)
     return generated_text.strip()
@@ -251,7 +149,7 @@ def upload_audio_to_cloudinary(file_path):
 elevenlabs_api_key = os.environ["ELEVEN_LABS_API_KEY"]
 voice_id = os.environ["ELEVEN_LABS_VOICE_ID"]
 
-def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key):
+def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key, audio_file_path="audio_output.mp3"):
     url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
     headers = {
         "Accept": "audio/mpeg",
@@ -268,14 +166,14 @@ def generate_audio_with_eleven_labs(text, voice_id, elevenlabs_api_key):
             "stability": 0
         }
     }
-    response = requests.post(url, json=data, headers=headers)
+    response = http.post(url, json=data, headers=headers)
     if response.status_code == 200:
         try:
-            audio_file_path = "audio_output.mp3"
             with open(audio_file_path, "wb") as audio_file:
                 audio_file.write(response.content)
-            print("The audio has been saved under the name 'audio_output.mp3'.")
+            print(f"The audio has been saved under the name '{audio_file_path}'.")
             uploaded_audio_url = upload_audio_to_cloudinary(audio_file_path)
+            os.remove(audio_file_path)
             if uploaded_audio_url:
                 print("Audio uploaded successfully!")
                 return uploaded_audio_url
@@ -306,7 +204,7 @@ class AIAvatarCreator:
             "watermark": 0,
             "useSr": False
         }
-        response = requests.post(url, json=data, headers=self.headers)
+        response = http.post(url, json=data, headers=self.headers)
         if response.status_code == 200:
             result = response.json()
             project_id = result["data"]["id"]
@@ -320,7 +218,7 @@ class AIAvatarCreator:
         print("Waiting for avatar video to be ready...")
         url = f"{os.getenv('MOVEMENT_PROJECT_URL')}/{project_id}"
         for i in range(max_retries):
-            response = requests.get(url, headers=self.headers)
+            response = http.get(url, headers=self.headers)
             if response.status_code == 200:
                 result = response.json()
                 video_url = result["data"]["videoUrl"]
@@ -349,67 +247,34 @@ def upload_and_post_video_v2(local_video_path, tweet_id, summary_text):
         print(f"Exception occurred during media upload: {e}")
         return None
 
-def save_tweet_data_to_json(data, filename="reply.json"):
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-    else:
-        existing_data = []
+ledger = ResponseLedger()
+ledger.import_json("reply.json")
+
+def save_tweet_data(data):
     data["main_tweet_id"] = data.get("main_tweet_id", "unknown")
-    existing_data.append(data)
-    with open(filename, 'w', encoding='utf-8') as file:
-        json.dump(existing_data, file, indent=4)
-
-def load_existing_tweet_data(filename="reply.json"):
-    if os.path.exists(filename):
-        with open(filename, 'r') as file:
-            try:
-                return json.load(file)
-            except json.JSONDecodeError:
-                print("JSON file is empty or invalid. Starting fresh.")
-                return []
-    else:
-        return []
+    ledger.record(data)
 
-def is_tweet_responded(main_tweet_id, existing_data):
-    if not existing_data:
-        return False
-    for tweet in existing_data:
-        if tweet.get("main_tweet_id") == main_tweet_id:
-            return True
-    return False
-
-def get_thread_tweets(tweet_id):
-    tweet_data = client.get_tweet(tweet_id, tweet_fields="conversation_id,author_id,text,referenced_tweets")
-    conversation_id = tweet_data.data["conversation_id"]
-    main_tweet_data = client.get_tweet(conversation_id, tweet_fields="text,author_id,referenced_tweets")
-    main_tweet = main_tweet_data.data
-    all_tweets = client.search_recent_tweets(
-        query=f"conversation_id:{conversation_id}",
-        tweet_fields="text,author_id,referenced_tweets",
-        max_results=100
-    )
-    tweet_list = [main_tweet]
-    if all_tweets.data:
-        for tw in all_tweets.data:
-            if tw.id != main_tweet.id:
-                tweet_list.append(tw)
-    sorted_tweets = sorted(tweet_list, key=lambda x: int(x.id))
-    return sorted_tweets
-
-def get_thread_context(tweet_id):
-    sorted_tweets = get_thread_tweets(tweet_id)
+def is_tweet_responded(main_tweet_id):
+    return ledger.has_main_tweet(main_tweet_id)
+
+thread_cache = ConversationCache(client)
+
+def get_thread_tweets(tweet_id, conversation_id=None, tweet=None):
+    return thread_cache.get_thread_tweets(tweet_id, conversation_id, tweet)
+
+def get_thread_context(tweet_id, conversation_id=None, tweet=None):
+    sorted_tweets = get_thread_tweets(tweet_id, conversation_id, tweet)
     context = []
     for t in sorted_tweets:
         context.append(t.text)
-        if t.id == tweet_id:
+        if str(t.id) == str(tweet_id):
             break
     return " ".join(context)
 
-claude_client = Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+claude_client = claude_limit.wrap(Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
 
 def generate_summary(response_text, thread_context=None):
-    new_client = Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"])
+    new_client = claude_limit.wrap(Anthropic(api_key=os.environ["ANTHROPIC_API_KEY"]))
     if thread_context:
         prompt = f"Tweet context: {thread_context}\nLea's response: {response_text}"
     else:
@@ -447,15 +312,20 @@ def generate_summary(response_text, thread_context=None):
         print(f"Error generating tweet: {e}")
         return ""
 
-def is_main_tweet_by_lea(tweet):
+def lookup_mention_authors(tweets):
+    tweet_ids = set()
+    for tweet in tweets:
+        tweet_ids.add(tweet.get('conversation_id'))
+        if 'referenced_tweets' in tweet:
+            tweet_ids.add(tweet['referenced_tweets'][0]['id'])
+    return get_tweet_authors(client, tweet_ids)
+
+def is_main_tweet_by_lea(tweet, tweet_authors):
     conversation_id = tweet.get('conversation_id')
     if not conversation_id:
         return False
     lea_user_id = "1850273360724348928"
-    main_tweet = client.get_tweet(conversation_id, tweet_fields='author_id')
-    if main_tweet and main_tweet.data and main_tweet.data.get('author_id') == lea_user_id:
-        return True
-    return False
+    return tweet_authors.get(str(conversation_id)) == lea_user_id
 
 def is_direct_mention(tweet):
     return '@lea_gpt' in tweet.get('text', '').lower()
@@ -466,12 +336,8 @@ def count_words_excluding_tags_and_emojis(text):
     cleaned_text = re.sub(r'\s+', ' ', text_without_emojis).strip()
     return len(cleaned_text.split())
 
-def get_tweet_url(tweet_id, client):
-    tweet_data = client.get_tweet(tweet_id, tweet_fields="author_id")
-    author_id = tweet_data.data["author_id"]
-    user_data = client.get_user(id=author_id, user_fields="username")
-    username = user_data.data["username"]
-    return f"https://x.com/{username}/status/{tweet_id}"
+def get_tweet_url(tweet_id, author_id):
+    return user_cache.tweet_url(client, tweet_id, author_id)
 
 SUBTITLES_API_KEY = os.environ["SUBTITLES_API_KEY"]
 TEMPLATE_ID = os.environ["SUBTITLES_TEMPLATE_ID"]
@@ -509,7 +375,8 @@ Word1 Word2 Word3 Word4"""
         "max_tokens": 4096
     }
     try:
-        response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
+        with claude_limit:
+            response = http.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
         if response.status_code != 200:
             print("Claude API error:", response.text)
             return None
@@ -534,7 +401,7 @@ def upload_video(file_path, api_key):
     headers = {"X-Api-Key": api_key}
     with open(file_path, 'rb') as file:
         files = {'file': file}
-        response = requests.post(url, headers=headers, files=files)
+        response = http.post(url, headers=headers, files=files)
     if response.status_code != 201:
         print("Error uploading video:", response.text)
         return None
@@ -546,7 +413,7 @@ def create_transcription_task(video_id, template_id, language='en'):
     url = f"https://api.subtitles.ai/videos/{video_id}/task"
     headers = {"Content-Type": "application/json", "X-Api-Key": SUBTITLES_API_KEY}
     payload = {"templateId": template_id, "language": language, "autoApprove": True}
-    response = requests.post(url, json=payload, headers=headers)
+    response = http.post(url, json=payload, headers=headers)
     if response.status_code != 201:
         print("Error creating transcription task:", response.text)
         return None
@@ -561,7 +428,7 @@ def check_task_status(video_id, task_id):
     max_retries = 30
     last_status = None
     while retry_count < max_retries:
-        response = requests.get(url, headers=headers)
+        response = http.get(url, headers=headers)
         if response.status_code != 200:
             print("Error checking status:", response.text)
             return None, None
@@ -583,7 +450,7 @@ def check_task_status(video_id, task_id):
 def get_transcript(video_id, task_id):
     url = f"https://api.subtitles.ai/videos/{video_id}/task/{task_id}/transcript"
     headers = {"X-Api-Key": SUBTITLES_API_KEY}
-    response = requests.get(url, headers=headers)
+    response = http.get(url, headers=headers)
     if response.status_code != 200:
         print("Error getting transcript:", response.text)
         return None
@@ -600,7 +467,7 @@ def create_subtitle_task(video_id, transcript):
         "autoApprove": True,
         "language": LANGUAGE
     }
-    response = requests.post(url, headers=headers, json=payload)
+    response = http.post(url, headers=headers, json=payload)
     if response.status_code != 201:
         print("Error creating subtitle task:", response.text)
         return None
@@ -610,149 +477,203 @@ def create_subtitle_task(video_id, transcript):
 
 lea_user_id = "1850273360724348928"
 
-def process_tweet(tweet):
+processed_main_tweet_ids = set()
+processed_main_tweet_ids_lock = threading.Lock()
+
+def claim_main_tweet(main_tweet_id):
+    with processed_main_tweet_ids_lock:
+        if main_tweet_id in processed_main_tweet_ids:
+            return False
+        if is_tweet_responded(main_tweet_id):
+            return False
+        processed_main_tweet_ids.add(main_tweet_id)
+        return True
+
+def release_main_tweet(main_tweet_id):
+    with processed_main_tweet_ids_lock:
+        processed_main_tweet_ids.discard(main_tweet_id)
+
+def download_video(video_url, local_video_path):
+    with http.get(video_url, stream=True) as r:
+        r.raise_for_status()
+        with open(local_video_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+    return local_video_path
+
+def add_subtitles(local_video_path, response_text):
+    video_id = upload_video(local_video_path, SUBTITLES_API_KEY)
+    if not video_id:
+        raise Exception("Failed to upload video to subtitles")
+    transcription_task_id = create_transcription_task(video_id, TEMPLATE_ID)
+    if not transcription_task_id:
+        raise Exception("Failed to create transcription task")
+    status, _ = check_task_status(video_id, transcription_task_id)
+    if not status:
+        raise Exception("Transcription task failed")
+    original_transcript = get_transcript(video_id, transcription_task_id)
+    if not original_transcript:
+        raise Exception("Failed to get transcript")
+    corrected_transcript = correct_transcript_with_claude(original_transcript, response_text)
+    if not corrected_transcript:
+        raise Exception("Failed to correct transcript")
+    subtitle_task_id = create_subtitle_task(video_id, corrected_transcript)
+    if not subtitle_task_id:
+        raise Exception("Failed to create subtitle task")
+    status, final_video_url = check_task_status(video_id, subtitle_task_id)
+    if not status or not final_video_url:
+        raise Exception("Failed to get final video URL")
+    return final_video_url
+
+def should_process_tweet(tweet, tweet_authors):
     tweet_id = tweet['id']
     tweet_text = tweet.get('text')
     author_id = tweet.get('author_id')
     if '@lea_gpt' not in tweet.get('text', '').lower():
         print(f"Tweet {tweet['id']} does not mention @lea_gpt. Ignoring...")
-        return
+        return False
     if tweet.get('in_reply_to_user_id') == lea_user_id:
         print(f"Tweet {tweet_id} is a reply to a Lea tweet. Ignored.")
-        return
+        return False
     if author_id == lea_user_id:
         print("Ignore tweets from the bot itself.")
-        return
+        return False
     if count_words_excluding_tags_and_emojis(tweet_text) < 1:
         print(f"Tweet {tweet_id} ignored due to having less than 1 word (excluding tags).")
-        return
-    if is_main_tweet_by_lea(tweet):
+        return False
+    if is_main_tweet_by_lea(tweet, tweet_authors):
         print(f"Tweet {tweet_id} is part of a thread where the main tweet is from Lea. Ignoring...")
-        return
+        return False
     if 'referenced_tweets' in tweet:
         referenced_tweet_id = tweet['referenced_tweets'][0]['id']
-        original_tweet = client.get_tweet(referenced_tweet_id)
-        if original_tweet.data['author_id'] != lea_user_id and '@lea_gpt' not in tweet_text:
+        if tweet_authors.get(str(referenced_tweet_id)) != lea_user_id and '@lea_gpt' not in tweet_text:
             print(f"Tweet {tweet_id} is not a direct mention to Lea. Ignoring...")
-            return
-    sorted_tweets = get_thread_tweets(tweet_id)
-    main_tweet = sorted_tweets[0]
-    main_tweet_id = main_tweet.id
-    existing_data = load_existing_tweet_data()
-    if is_tweet_responded(main_tweet_id, existing_data):
+            return False
+    return True
+
+# Each mention moves through these stages as a job dict. Stages run on their
+# own workers with bounded queues in between, so one mention can be in TTS
+# while another is still waiting on Movement or subtitles.
+def prepare_stage(job):
+    tweet = job['tweet']
+    tweet_id = tweet['id']
+    tweet_text = tweet.get('text')
+    conversation_id = tweet.get('conversation_id')
+    mention = tweepy.Tweet(tweet)
+    sorted_tweets = get_thread_tweets(tweet_id, conversation_id, mention)
+    main_tweet_id = sorted_tweets[0].id
+    if not claim_main_tweet(main_tweet_id):
         print(f"Lea already replied to the main tweet {main_tweet_id}. Skipping...")
-        return
+        return None
+    job['main_tweet_id'] = main_tweet_id
     print(f"Tweet received that mentioned the bot: {tweet_text}")
+    print(f"Tweet URL: {get_tweet_url(tweet_id, tweet.get('author_id'))}")
     print(f"Main tweet ID: {main_tweet_id}")
-    context = get_thread_context(tweet_id)
+    context = get_thread_context(tweet_id, conversation_id, mention)
+    job['thread_context'] = context
     context += " " + tweet_text
-    current_tweet_url = get_tweet_url(tweet_id, client)
-    image_analysis = image_analyzer.process_tweet_image(current_tweet_url)
-    if not image_analysis and 'referenced_tweets' in tweet:
-        for ref in tweet['referenced_tweets']:
-            if ref['type'] == 'replied_to':
-                parent_tweet_id = ref['id']
-                parent_tweet_url = get_tweet_url(parent_tweet_id, client)
-                image_analysis = image_analyzer.process_tweet_image(parent_tweet_url)
-                if image_analysis:
-                    print("Image found in the parent tweet.")
-                break
+    image_analysis = image_analyzer.process_hydrated_tweet(tweet, referenced_types=("replied_to",))
     if image_analysis:
         print("Result of image analysis :")
         print(image_analysis)
         context += "\nImage context: " + image_analysis
-    thread_context = get_thread_context(tweet_id)
-    response_text = generate_text_with_claude(context, image_analysis if image_analysis else None)
-    summary_text = generate_summary(response_text, thread_context)
+    job['context'] = context
+    job['image_analysis'] = image_analysis
+    return job
+
+def llm_stage(job):
+    job['response_text'] = generate_text_with_claude(job['context'], job['image_analysis'] if job['image_analysis'] else None)
+    job['summary_text'] = generate_summary(job['response_text'], job['thread_context'])
     print("summary:")
-    print(summary_text)
-    audio_url = generate_audio_with_eleven_labs(response_text, voice_id, elevenlabs_api_key)
-    if audio_url:
-        avatar_creator = AIAvatarCreator(movement_api_key)
-        project_id = avatar_creator.create_avatar(photo_url, audio_url, box_coordinates)
-        if project_id:
-            video_url = avatar_creator.get_video_url(project_id)
-            if video_url:
-                local_video_path = "video_response.mp4"
-                with requests.get(video_url, stream=True) as r:
-                    r.raise_for_status()
-                    with open(local_video_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                try:
-                    video_id = upload_video(local_video_path, SUBTITLES_API_KEY)
-                    if not video_id:
-                        raise Exception("Failed to upload video to subtitles")
-                    transcription_task_id = create_transcription_task(video_id, TEMPLATE_ID)
-                    if not transcription_task_id:
-                        raise Exception("Failed to create transcription task")
-                    status, _ = check_task_status(video_id, transcription_task_id)
-                    if not status:
-                        raise Exception("Transcription task failed")
-                    original_transcript = get_transcript(video_id, transcription_task_id)
-                    if not original_transcript:
-                        raise Exception("Failed to get transcript")
-                    corrected_transcript = correct_transcript_with_claude(original_transcript, response_text)
-                    if not corrected_transcript:
-                        raise Exception("Failed to correct transcript")
-                    subtitle_task_id = create_subtitle_task(video_id, corrected_transcript)
-                    if not subtitle_task_id:
-                        raise Exception("Failed to create subtitle task")
-                    status, final_video_url = check_task_status(video_id, subtitle_task_id)
-                    if not status or not final_video_url:
-                        raise Exception("Failed to get final video URL")
-                    subtitled_video_path = "video_response_subtitled.mp4"
-                    with requests.get(final_video_url, stream=True) as r:
-                        r.raise_for_status()
-                        with open(subtitled_video_path, 'wb') as f:
-                            for chunk in r.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                    tweet_id_video = upload_and_post_video_v2(subtitled_video_path, tweet_id, summary_text)
-                    tweet_data = {
-                        "main_tweet_id": main_tweet_id,
-                        "tweet_text_received": tweet_text,
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
-                        "bot_response": response_text,
-                        "tweet_id_video_posted": tweet_id_video,
-                        "tweet_id_tagging_bot": tweet_id
-                    }
-                    save_tweet_data_to_json(tweet_data)
-                    os.remove(local_video_path)
-                    os.remove(subtitled_video_path)
-                except Exception as e:
-                    print(f"Error in subtitle process: {e}")
-                    tweet_id_video = upload_and_post_video_v2(local_video_path, tweet_id, summary_text)
-                    os.remove(local_video_path)
-            else:
-                print("Failed to retrieve video URL.")
-        else:
-            print("Failed to create avatar.")
-    else:
-        print("Failed to synthesize audio.")
+    print(job['summary_text'])
+    return job
 
-processed_main_tweet_ids = set()
-last_processed_id = None
+def tts_stage(job):
+    audio_url = generate_audio_with_eleven_labs(job['response_text'], voice_id, elevenlabs_api_key, f"audio_output_{job['tweet']['id']}.mp3")
+    if not audio_url:
+        print("Failed to synthesize audio.")
+        return None
+    job['audio_url'] = audio_url
+    return job
+
+def avatar_stage(job):
+    avatar_creator = AIAvatarCreator(movement_api_key)
+    project_id = avatar_creator.create_avatar(photo_url, job['audio_url'], box_coordinates)
+    if not project_id:
+        print("Failed to create avatar.")
+        return None
+    video_url = avatar_creator.get_video_url(project_id)
+    if not video_url:
+        print("Failed to retrieve video URL.")
+        return None
+    job['local_video_path'] = download_video(video_url, f"video_response_{job['tweet']['id']}.mp4")
+    return job
 
-while True:
+def subtitles_stage(job):
     try:
-        print("Checking for new tweets...")
-        tweets = search_tweets("@lea_gpt", since_id=last_processed_id)
-        if tweets:
-            filtered_tweets = [tweet for tweet in tweets if is_direct_mention(tweet)]
-            max_id_this_round = None
-            for tweet in filtered_tweets:
-                tweet_id = tweet['id']
-                if max_id_this_round is None or int(tweet_id) > int(max_id_this_round):
-                    max_id_this_round = tweet_id
-                process_tweet(tweet)
-            if max_id_this_round:
-                last_processed_id = max_id_this_round
-        else:
-            print("No relevant tweets found.")
-        delay = random.randint(15, 30)
-        print(f"Waiting for {delay} seconds before checking again...")
-        time.sleep(delay)
+        final_video_url = add_subtitles(job['local_video_path'], job['response_text'])
+        job['subtitled_video_path'] = download_video(final_video_url, f"video_response_subtitled_{job['tweet']['id']}.mp4")
     except Exception as e:
-        print(f"Error encountered: {e}. Retrying in 5-8 minutes...")
-        delay = random.randint(300, 480)
-        time.sleep(delay)
+        print(f"Error in subtitle process: {e}")
+    return job
+
+def post_stage(job):
+    tweet = job['tweet']
+    tweet_id = tweet['id']
+    if not job.get('subtitled_video_path'):
+        upload_and_post_video_v2(job['local_video_path'], tweet_id, job['summary_text'])
+        return job
+    tweet_id_video = upload_and_post_video_v2(job['subtitled_video_path'], tweet_id, job['summary_text'])
+    tweet_data = {
+        "main_tweet_id": job['main_tweet_id'],
+        "tweet_text_received": tweet.get('text'),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "bot_response": job['response_text'],
+        "tweet_id_video_posted": tweet_id_video,
+        "tweet_id_tagging_bot": tweet_id
+    }
+    save_tweet_data(tweet_data)
+    return job
+
+def finish_job(job):
+    for key in ('local_video_path', 'subtitled_video_path'):
+        if job.get(key) and os.path.exists(job[key]):
+            os.remove(job[key])
+    http.log_stats()
+    if job.get('main_tweet_id') is not None:
+        release_main_tweet(job['main_tweet_id'])
+
+def build_mention_pipeline():
+    return Pipeline([
+        Stage("prepare", prepare_stage, stage_workers("MAX_CONCURRENT_MENTIONS", 4)),
+        Stage("claude", llm_stage, stage_workers("CLAUDE_MAX_CONCURRENCY", 4)),
+        Stage("elevenlabs", tts_stage, stage_workers("ELEVEN_LABS_MAX_CONCURRENCY", 2)),
+        Stage("movement", avatar_stage, stage_workers("MOVEMENT_MAX_CONCURRENCY", 2)),
+        Stage("subtitles", subtitles_stage, stage_workers("SUBTITLES_MAX_CONCURRENCY", 2)),
+        Stage("post", post_stage, stage_workers("POST_MAX_CONCURRENCY", 1))
+    ], on_done=finish_job).start()
+
+def build_mention_source():
+    search = lambda since_id: search_tweets("@lea_gpt", since_id=since_id)
+    if os.getenv("MENTION_SOURCE", "poll") == "stream":
+        return StreamingMentionSource(
+            bearer_token,
+            MENTION_QUERY,
+            MENTION_FIELDS,
+            catch_up=search,
+            on_includes=remember_includes
+        )
+    return PollingMentionSource(search, poll_scheduler)
+
+def handle_mentions(tweets):
+    filtered_tweets = [tweet for tweet in tweets if is_direct_mention(tweet)]
+    if filtered_tweets:
+        tweet_authors = lookup_mention_authors(filtered_tweets)
+        for tweet in filtered_tweets:
+            if should_process_tweet(tweet, tweet_authors):
+                mention_pipeline.submit({'tweet': tweet})
+    mention_pipeline.wait_for_capacity(MAX_PENDING_MENTIONS)
+
+mention_pipeline = build_mention_pipeline()
+mention_source = build_mention_source()
+mention_source.run(handle_mentions)
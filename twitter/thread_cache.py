@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from watchlist import snowflake_time
+
+THREAD_CACHE_TTL = int(os.getenv("THREAD_CACHE_TTL", "3600"))
+THREAD_CACHE_MAX_ENTRIES = int(os.getenv("THREAD_CACHE_MAX_ENTRIES", "500"))
+THREAD_CACHE_REFRESH_SECONDS = int(os.getenv("THREAD_CACHE_REFRESH_SECONDS", "15"))
+
+THREAD_TWEET_FIELDS = "text,author_id,referenced_tweets"
+# Recent search rejects a since_id older than its 7 day window.
+SEARCH_WINDOW = timedelta(days=7) - timedelta(minutes=5)
+
+class ConversationThread:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.main_tweet = None
+        self.tweets = {}
+        self.newest_id = None
+        self.replies_fetched = False
+        self.fetched_at = 0
+        self.last_used = time.monotonic()
+
+    def add(self, tweets):
+        for tw in tweets:
+            self.tweets[str(tw.id)] = tw
+            if self.newest_id is None or int(tw.id) > int(self.newest_id):
+                self.newest_id = str(tw.id)
+
+    def sorted_tweets(self):
+        return sorted(self.tweets.values(), key=lambda x: int(x.id))
+
+class ConversationCache:
+    def __init__(self, client, ttl=THREAD_CACHE_TTL, max_entries=THREAD_CACHE_MAX_ENTRIES, refresh_seconds=THREAD_CACHE_REFRESH_SECONDS):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.threads = OrderedDict()
+
+    def _get_entry(self, conversation_id):
+        now = time.monotonic()
+        with self.lock:
+            for key in [k for k, t in self.threads.items() if now - t.last_used > self.ttl]:
+                del self.threads[key]
+            thread = self.threads.get(conversation_id)
+            if thread is None:
+                thread = ConversationThread()
+                self.threads[conversation_id] = thread
+                while len(self.threads) > self.max_entries:
+                    self.threads.popitem(last=False)
+            else:
+                self.threads.move_to_end(conversation_id)
+            thread.last_used = now
+            return thread
+
+    def _fetch_replies(self, thread, conversation_id):
+        # Only refreshes are incremental: on the first fetch newest_id is the
+        # root, which may be older than the search window allows.
+        since_id = None
+        if thread.replies_fetched and snowflake_time(thread.newest_id) > datetime.now(timezone.utc) - SEARCH_WINDOW:
+            since_id = thread.newest_id
+        all_tweets = self.client.search_recent_tweets(
+            query=f"conversation_id:{conversation_id}",
+            tweet_fields=THREAD_TWEET_FIELDS,
+            max_results=100,
+            since_id=since_id
+        )
+        thread.replies_fetched = True
+        thread.fetched_at = time.monotonic()
+        if all_tweets.data:
+            thread.add(all_tweets.data)
+
+    def get_thread_tweets(self, tweet_id, conversation_id=None, tweet=None):
+        # tweet is the triggering mention when the caller already holds it;
+        # it is added to the thread even if the refresh is skipped.
+        if conversation_id is None:
+            tweet_data = self.client.get_tweet(tweet_id, tweet_fields="conversation_id")
+            conversation_id = tweet_data.data["conversation_id"]
+        conversation_id = str(conversation_id)
+        thread = self._get_entry(conversation_id)
+        with thread.lock:
+            if thread.main_tweet is None:
+                main_tweet_data = self.client.get_tweet(conversation_id, tweet_fields=THREAD_TWEET_FIELDS)
+                thread.main_tweet = main_tweet_data.data
+                thread.add([thread.main_tweet])
+                self._fetch_replies(thread, conversation_id)
+            elif str(tweet_id) not in thread.tweets and time.monotonic() - thread.fetched_at >= self.refresh_seconds:
+                self._fetch_replies(thread, conversation_id)
+            if tweet is not None:
+                thread.add([tweet])
+            return thread.sorted_tweets()
@@ -0,0 +1,42 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+TIMELINE_MAX_WORKERS = int(os.getenv("TIMELINE_MAX_WORKERS", "8"))
+TIMELINE_DEADLINE = float(os.getenv("TIMELINE_DEADLINE", "15"))
+TIMELINE_REQUEST_TIMEOUT = float(os.getenv("TIMELINE_REQUEST_TIMEOUT", "10"))
+
+class TimelineFanout:
+    def __init__(self, max_workers=TIMELINE_MAX_WORKERS, deadline=TIMELINE_DEADLINE):
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="timeline")
+
+    def run(self, items, fetch, raise_errors=()):
+        # The deadline bounds how long the cycle waits, not the fetches:
+        # cancel() only drops fetches still queued. One already running keeps
+        # its worker until its request timeout and its result is discarded.
+        # Errors in raise_errors (rate limits) are raised once the batch is
+        # done, so the caller can back off instead of fanning out again.
+        started = time.monotonic()
+        futures = {self.executor.submit(fetch, item): item for item in items}
+        done, not_done = wait(futures, timeout=self.deadline)
+        results = {}
+        fatal = None
+        for future in done:
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except raise_errors as e:
+                print(f"Rate limited fetching tweets for {item}: {e}")
+                fatal = fatal or e
+            except Exception as e:
+                print(f"Error fetching tweets for {item}: {e}")
+        for future in not_done:
+            if future.cancel():
+                print(f"Timed out before fetching tweets for {futures[future]}, skipping this cycle.")
+            else:
+                print(f"Still fetching tweets for {futures[future]} at the deadline, ignoring the result this cycle.")
+        print(f"Fetched {len(results)}/{len(futures)} timelines in {time.monotonic() - started:.1f}s")
+        if fatal:
+            raise fatal
+        return results
@@ -0,0 +1,14 @@
+TWEET_LOOKUP_BATCH_SIZE = 100
+
+def get_tweets_by_id(client, tweet_ids, **kwargs):
+    tweet_ids = list(dict.fromkeys(str(tweet_id) for tweet_id in tweet_ids if tweet_id))
+    tweets = {}
+    for start in range(0, len(tweet_ids), TWEET_LOOKUP_BATCH_SIZE):
+        response = client.get_tweets(ids=tweet_ids[start:start + TWEET_LOOKUP_BATCH_SIZE], **kwargs)
+        for tw in response.data or []:
+            tweets[str(tw.id)] = tw
+    return tweets
+
+def get_tweet_authors(client, tweet_ids):
+    tweets = get_tweets_by_id(client, tweet_ids, tweet_fields=["author_id"])
+    return {tweet_id: str(tw.author_id) for tweet_id, tw in tweets.items()}
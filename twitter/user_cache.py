@@ -0,0 +1,40 @@
+import os
+import threading
+from collections import OrderedDict
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+class UsernameCache:
+    def __init__(self, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.usernames = OrderedDict()
+
+    def remember(self, user_id, username):
+        with self.lock:
+            self.usernames[str(user_id)] = username
+            self.usernames.move_to_end(str(user_id))
+            while len(self.usernames) > self.max_entries:
+                self.usernames.popitem(last=False)
+
+    def remember_users(self, users):
+        for user in users or []:
+            self.remember(user["id"], user["username"])
+
+    def get(self, user_id):
+        with self.lock:
+            username = self.usernames.get(str(user_id))
+            if username is not None:
+                self.usernames.move_to_end(str(user_id))
+            return username
+
+    def resolve(self, client, user_id):
+        username = self.get(user_id)
+        if username is None:
+            user_data = client.get_user(id=user_id, user_fields="username")
+            username = user_data.data["username"]
+            self.remember(user_id, username)
+        return username
+
+    def tweet_url(self, client, tweet_id, author_id):
+        return f"https://x.com/{self.resolve(client, author_id)}/status/{tweet_id}"
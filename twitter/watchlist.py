@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+WATCHLIST_PATH = os.getenv("WATCHLIST_PATH", "watchlist.db")
+WATCHLIST_RETRY_SECONDS = int(os.getenv("WATCHLIST_RETRY_SECONDS", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    handle TEXT PRIMARY KEY,
+    username TEXT,
+    user_id TEXT,
+    resolved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    handle TEXT PRIMARY KEY,
+    since_id TEXT NOT NULL
+);
+"""
+
+TWITTER_EPOCH_MS = 1288834974657
+
+def snowflake_time(tweet_id):
+    return datetime.fromtimestamp(((int(tweet_id) >> 22) + TWITTER_EPOCH_MS) / 1000, tz=timezone.utc)
+
+def dedupe_usernames(usernames):
+    seen = {}
+    for username in usernames:
+        seen.setdefault(username.lower(), username)
+    return list(seen.values())
+
+class Watchlist:
+    def __init__(self, usernames, path=WATCHLIST_PATH, retry_seconds=WATCHLIST_RETRY_SECONDS):
+        self.usernames = dedupe_usernames(usernames)
+        self.retry_seconds = retry_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def _rows(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT handle, username, user_id, resolved_at FROM users").fetchall()
+        return {row[0]: row for row in rows}
+
+    def _store(self, handle, username, user_id):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users (handle, username, user_id, resolved_at) VALUES (?, ?, ?, ?)",
+                (handle, username, user_id, time.time())
+            )
+            self.conn.commit()
+
+    def resolve(self, client):
+        rows = self._rows()
+        now = time.time()
+        pending = [
+            username for username in self.usernames
+            if username.lower() not in rows
+            or (rows[username.lower()][2] is None and now - rows[username.lower()][3] >= self.retry_seconds)
+        ]
+        for i in range(0, len(pending), 100):
+            batch = pending[i:i + 100]
+            response = client.get_users(usernames=batch, user_fields=["username"])
+            found = set()
+            for user in response.data or []:
+                found.add(user.username.lower())
+                self._store(user.username.lower(), user.username, str(user.id))
+            for username in batch:
+                if username.lower() not in found:
+                    print(f"Could not resolve @{username}, retrying in {self.retry_seconds} seconds.")
+                    self._store(username.lower(), username, None)
+            print(f"Resolved {len(found)}/{len(batch)} watchlist handles.")
+        rows = self._rows()
+        return {
+            username: rows[username.lower()][2]
+            for username in self.usernames
+            if username.lower() in rows and rows[username.lower()][2]
+        }
+
+    def update_username(self, username, current_username):
+        row = self._rows().get(username.lower())
+        if row and row[1] != current_username:
+            print(f"@{username} is now @{current_username}.")
+            self._store(username.lower(), current_username, row[2])
+
+    def forget(self, username):
+        with self.lock:
+            self.conn.execute("DELETE FROM users WHERE handle = ?", (username.lower(),))
+            self.conn.commit()
+
+    def since_ids(self, start_time=None):
+        # A watermark older than start_time adds nothing over start_time, and
+        # recent search rejects since_ids older than its 7 day window.
+        with self.lock:
+            rows = self.conn.execute("SELECT handle, since_id FROM watermarks").fetchall()
+        watermarks = {
+            handle: since_id for handle, since_id in rows
+            if start_time is None or snowflake_time(since_id) > start_time
+        }
+        return {username: watermarks[username.lower()] for username in self.usernames if username.lower() in watermarks}
+
+    def advance(self, username, tweet_id):
+        with self.lock:
+            row = self.conn.execute("SELECT since_id FROM watermarks WHERE handle = ?", (username.lower(),)).fetchone()
+            if row and int(row[0]) >= int(tweet_id):
+                return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks (handle, since_id) VALUES (?, ?)",
+                (username.lower(), str(tweet_id))
+            )
+            self.conn.commit()
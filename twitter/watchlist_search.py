@@ -0,0 +1,69 @@
+import os
+
+WATCHLIST_QUERY_MAX_LENGTH = int(os.getenv("WATCHLIST_QUERY_MAX_LENGTH", "512"))
+WATCHLIST_QUERY_SUFFIX = "-is:retweet -is:reply"
+WATCHLIST_MAX_PAGES = int(os.getenv("WATCHLIST_MAX_PAGES", "10"))
+
+# Media and referenced tweets come back expanded, so the image analyzer never
+# has to fetch a watchlist tweet, or the tweet it quotes, a second time.
+TWEET_FIELDS = ["created_at","author_id","text","public_metrics","attachments","referenced_tweets"]
+TWEET_EXPANSIONS = ["author_id","attachments.media_keys","referenced_tweets.id","referenced_tweets.id.attachments.media_keys"]
+MEDIA_FIELDS = ["url","type"]
+
+def pack_queries(usernames, suffix=WATCHLIST_QUERY_SUFFIX, max_length=WATCHLIST_QUERY_MAX_LENGTH):
+    queries = []
+    terms = []
+    for username in usernames:
+        candidate = terms + [f"from:{username}"]
+        if terms and len(f"({' OR '.join(candidate)}) {suffix}") > max_length:
+            queries.append(f"({' OR '.join(terms)}) {suffix}")
+            candidate = [f"from:{username}"]
+        terms = candidate
+    if terms:
+        queries.append(f"({' OR '.join(terms)}) {suffix}")
+    return queries
+
+def search_watchlist(client, usernames, start_time, since_ids=None, on_includes=None, max_pages=WATCHLIST_MAX_PAGES):
+    handles = {username.lower(): username for username in usernames}
+    since_ids = {username.lower(): int(since_id) for username, since_id in (since_ids or {}).items()}
+    found = []
+    queries = pack_queries(list(handles.values()))
+    calls = 0
+    for query in queries:
+        # A packed query can only carry one since_id, so use the oldest
+        # watermark of its accounts and drop what each account already saw.
+        packed = [term[len("from:"):].lower() for term in query.split(")")[0].lstrip("(").split(" OR ")]
+        since_id = min(since_ids[handle] for handle in packed) if all(handle in since_ids for handle in packed) else None
+        next_token = None
+        for _ in range(max_pages):
+            response = client.search_recent_tweets(
+                query=query,
+                start_time=None if since_id else start_time,
+                since_id=since_id,
+                max_results=100,
+                next_token=next_token,
+                tweet_fields=TWEET_FIELDS,
+                expansions=TWEET_EXPANSIONS,
+                user_fields=["username","public_metrics"],
+                media_fields=MEDIA_FIELDS
+            )
+            calls += 1
+            users = (response.includes or {}).get('users', [])
+            if on_includes and response.includes:
+                on_includes(response.includes)
+            authors = {str(user.id): user for user in users}
+            for tw in response.data or []:
+                user = authors.get(str(tw.author_id))
+                author = user.username if user else ""
+                if int(tw.id) <= since_ids.get(author.lower(), 0):
+                    continue
+                found.append({
+                    'tweet': tw,
+                    'username': handles.get(author.lower(), author),
+                    'followers': ((user.public_metrics or {}) if user else {}).get('followers_count', 0)
+                })
+            next_token = (response.meta or {}).get('next_token')
+            if not next_token:
+                break
+    print(f"Watchlist search: {len(found)} tweets from {len(handles)} accounts in {calls} calls ({len(queries)} queries).")
+    return found